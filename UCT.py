@@ -3,15 +3,115 @@ This file contains implementations of UCT algorithm
 Part of game.py logic
 """
 
+from array import array
 from collections import defaultdict
-import copy
 import math
+import multiprocessing
 import sys
 import time
 import random
 
 import util
 from game import Agent
+from solver import EndgameSolver
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, UCTArrayAgent falls back to a plain loop
+    numpy = None
+
+
+class SearchBudget(object):
+    """
+        Stop condition of one search: wall-clock time, iterations, playouts and/or tree nodes - whichever is exhausted first (None - no limit)
+        The clock is read only every checkInterval iterations, the interval adapts to the measured iteration rate
+        so that the clock is read about CLOCK_CHECKS times per time limit and the deadline is still met
+    """
+    CLOCK_CHECKS = 50
+
+    def __init__(self, timeLimit=None, iterations=None, playouts=None, nodes=None):
+        self.timeLimit = timeLimit
+        self.iterationLimit = iterations
+        self.playoutLimit = playouts
+        self.nodeLimit = nodes
+        self.iterations = 0
+        self.playouts = 0
+        self.checkInterval = 1
+        self.nextCheck = 0
+        self.start = time.time()
+
+    def count(self, iterations=1, playouts=1):
+        """ Registers finished iterations and the playouts they used """
+        self.iterations += iterations
+        self.playouts += playouts
+
+    def isExhausted(self, nodes=0):
+        if self.iterationLimit is not None and self.iterations >= self.iterationLimit: return True
+        if self.playoutLimit is not None and self.playouts >= self.playoutLimit: return True
+        if self.nodeLimit is not None and nodes >= self.nodeLimit: return True
+        if self.timeLimit is None or self.iterations < self.nextCheck: return False
+        elapsed = time.time() - self.start
+        if elapsed >= self.timeLimit: return True
+        if elapsed > 0 and self.iterations > 0:
+            rate = self.iterations / elapsed
+            self.checkInterval = max(1, int(min(self.timeLimit / SearchBudget.CLOCK_CHECKS, (self.timeLimit - elapsed) / 2) * rate))
+        self.nextCheck = self.iterations + self.checkInterval
+        return False
+
+
+def _noClock():
+    """ Stand-in for time.time when phase timing is off """
+    return 0.0
+
+
+class SearchStats(object):
+    """
+        Statistics of one search (one getAction call), available as agent.stats and passed to statsCallback
+        Phase times, depths and transposition hits are collected only if the agent has collectStats on (timed)
+    """
+
+    def __init__(self, timed=False):
+        self.timed = timed
+        self.clock = time.time if timed else _noClock
+        self.selectionTime = 0.0  # tree descent, without expansion
+        self.expansionTime = 0.0
+        self.rolloutTime = 0.0
+        self.backupTime = 0.0
+        self.elapsed = 0.0
+        self.iterations = 0
+        self.playouts = 0
+        self.maxDepth = 0
+        self.totalDepth = 0
+        self.nodeCount = 0
+        self.nodeLimitHits = 0
+        self.transpositionLookups = 0
+        self.transpositionHits = 0
+        self.rootVisits = []  # (action, N, expected value) of the root children
+        self.profile = None  # profiler passed to the agent, if any
+
+    def addDepth(self, depth):
+        self.maxDepth = max(self.maxDepth, depth)
+        self.totalDepth += depth
+
+    def getAverageDepth(self):
+        return self.totalDepth / float(self.iterations) if self.timed and self.iterations > 0 else 0.0
+
+    def getTranspositionHitRate(self):
+        return self.transpositionHits / float(self.transpositionLookups) if self.transpositionLookups > 0 else 0.0
+
+    def asDict(self):
+        """ JSON friendly form """
+        return {"selectionTime": self.selectionTime, "expansionTime": self.expansionTime, "rolloutTime": self.rolloutTime, "backupTime": self.backupTime,
+                "elapsed": self.elapsed, "iterations": self.iterations, "playouts": self.playouts, "maxDepth": self.maxDepth,
+                "averageDepth": self.getAverageDepth(), "nodeCount": self.nodeCount, "nodeLimitHits": self.nodeLimitHits,
+                "transpositionHitRate": self.getTranspositionHitRate(), "rootVisits": self.rootVisits}
+
+
+def _addProgressiveBias(node, children, L):
+    """ Adds the progressive bias of the children (see UCTAgent progressiveBias) to their scores L, if the agent uses it """
+    if not node.parentAgent.progressiveBias: return L
+    weight = node.parentAgent.progressiveBias
+    return [score + weight * n.prior / (n.getExpanded() + 1) for score, n in zip(L, children)]
 
 
 class UCTAgent(Agent):
@@ -34,8 +134,10 @@ class UCTAgent(Agent):
                 UCT Method: Assumes that all childs are expanded
                 Implements given policy
             """
-            L = [n.getExpectedValue() + self.C * math.sqrt(2 * math.sqrt(node.getExpanded()) / n.getExpanded()) for n in node.children]
-            return node.children[L.index(max(L))]
+            children = node.getOpenChildren()
+            L = [n.getExpectedValue() + self.C * math.sqrt(2 * math.sqrt(node.getExpanded()) / n.getExpanded()) for n in children]
+            L = _addProgressiveBias(node, children, L)
+            return children[L.index(max(L))]
 
     class UCBPolicy(object):
         C = math.sqrt(2)
@@ -58,8 +160,10 @@ class UCTAgent(Agent):
                 UCT Method: Assumes that all childs are expanded
                 Implements given policy
             """
-            L = [n.getExpectedValue() + self.C * math.sqrt(2 * math.log(node.getExpanded()) / n.getExpanded()) for n in node.children]
-            return node.children[L.index(max(L))]
+            children = node.getOpenChildren()
+            L = [n.getExpectedValue() + self.C * math.sqrt(2 * math.log(node.getExpanded()) / n.getExpanded()) for n in children]
+            L = _addProgressiveBias(node, children, L)
+            return children[L.index(max(L))]
 
     class EGreedyPolicy(object):
         """ Class for best child policy based on epsilon - greedy """
@@ -77,9 +181,52 @@ class UCTAgent(Agent):
                 UCT Method: Assumes that all childs are expanded
                 Implements given policy
             """
-            if node.getExpanded() == 0: return random.choice(node.children)
-            en = min(1, (self.c * len(node.children)) / (self.d ** 2 * node.getExpanded()))
-            return node.best_child[1] if random.random() > en else random.choice(node.children)
+            children = node.getOpenChildren()
+            if node.getExpanded() == 0: return random.choice(children)
+            en = min(1, (self.c * len(children)) / (self.d ** 2 * node.getExpanded()))
+            return node.best_child[1] if random.random() > en else random.choice(children)
+
+    class RAVEPolicy(object):
+        """
+            Class for best child policy blending UCB with all-moves-as-first (AMAF) values of the actions
+            The agent collects the AMAF statistics when this policy is used (RAVE mode)
+        """
+        amaf = True
+
+        def __init__(self, k=1000.0, b=None, C=1 / (2 * math.sqrt(2))):
+            """
+                k - hand-selected schedule: beta = sqrt(k / (3N + k)), AMAF and UCT values weigh the same at N = k visits
+                b - if given, minimum MSE schedule: beta = Na / (N + Na + 4 b^2 N Na) (b - assumed bias of AMAF values)
+            """
+            self.k = k
+            self.b = b
+            self.C = C
+
+        def setParams(self, k=None, b=None, C=None):
+            if k is not None: self.k = k
+            if b is not None: self.b = b
+            if C is not None: self.C = C
+
+        def getBeta(self, N, amafN):
+            if self.b is None: return math.sqrt(self.k / (3 * N + self.k))
+            return amafN / (N + amafN + 4 * self.b ** 2 * N * amafN)
+
+        def bestChild(self, node):
+            """
+                UCT Method: Assumes that all childs are expanded
+                Implements given policy
+            """
+            children = node.getOpenChildren()
+            logN = math.log(node.getExpanded())
+            amafNs, amafQs = (node.amafN, node.amafQ) if node.amafN is not None else ({}, {})  # None - no backup yet (pending virtual loss)
+            L = []
+            for n in children:
+                N, amafN = n.getExpanded(), amafNs.get(n.action, 0.0)
+                beta = self.getBeta(N, amafN) if amafN > 0 else 0.0
+                amafValue = amafQs[n.action] / amafN if amafN > 0 else 0.0
+                L.append((1 - beta) * n.getExpectedValue() + beta * amafValue + self.C * math.sqrt(2 * logN / N))
+            L = _addProgressiveBias(node, children, L)
+            return children[L.index(max(L))]
 
     class UCTNode(object):
         """ Node class for UCT algorithm """
@@ -91,8 +238,12 @@ class UCTAgent(Agent):
             self.action = action
             self.parentAgent = parentAgent
             self.state = state
+            self.key = state.transpositionKey()  # key of the transposition statistics (shared by symmetric positions)
             self.leftLegalActions = self.state.getLegalActions()
             random.shuffle(self.leftLegalActions)  # randomly permute the list (useful for expand)
+            if parentAgent is not None and parentAgent.priorFunction is not None:  # best prior last - expanded first (ties stay in random order)
+                self.leftLegalActions.sort(key=lambda action: parentAgent.priorFunction(state, action))
+            self.prior = 0.0  # prior of the action leading to the node
             self.N = 0  # increased during the backup phase
             self._initMoves = len(self.leftLegalActions)
             self.Q = 0.0  # sum of all games played through this node
@@ -100,6 +251,12 @@ class UCTAgent(Agent):
             self.children_count = self.leftLegalActions  # children count useful for O(1) EGreedyPolicy
             self.best_child = (0, None)  # best child pointer usefor for O(1) EGreedyPolicy
             self.best_child_UCB1 = (0, None)  # best child pointer according to UCB policy (O(1) pick)
+            self.solved = None  # exact evaluation (array of rewards) once the node is proven by the endgame solver
+            self.solvedChildren = 0
+            self.bestSolved = None  # proven child best for the player to move
+            self.amafN = None  # RAVE mode: action -> simulations through the node in which the player to move took it later
+            self.amafQ = None  # action -> sum of their values
+            if parentAgent is not None and parentAgent.transpositions and parentAgent.transpositionStore is not None: parentAgent.warmStart(self.key)
 
         def getLegalActions():
             return self.leftLegalActions
@@ -112,124 +269,687 @@ class UCTAgent(Agent):
             if self.parentAgent.transpositions == False:
                 return self.Q / float(self.N)
             else:
-                return self.parentAgent.Qdict[self.state] / self.parentAgent.Ndict[self.state]
+                return self.parentAgent.Qdict[self.key] / self.parentAgent.Ndict[self.key]
 
         def getExpanded(self):
-            return self.N if self.parentAgent.transpositions == False else self.parentAgent.Ndict[self.state]
+            return self.N if self.parentAgent.transpositions == False else self.parentAgent.Ndict[self.key]
 
         def addExpanded(self):
             if self.parentAgent.transpositions == False:
                 self.N += 1
             else:
-                self.parentAgent.Ndict[self.state] += 1
+                self.parentAgent.Ndict[self.key] += 1
 
         def addExpectedValue(self, value):
             """ adds expected value, if transposition option is on uses dict """
             if self.parentAgent.transpositions == False:
                 self.Q += value
             else:
-                self.parentAgent.Qdict[self.state] += value  # Note : expectedValue is merely accumulated Q not divided yet
+                self.parentAgent.Qdict[self.key] += value  # Note : expectedValue is merely accumulated Q not divided yet
 
         def isFullyExpanded(self):
             return len(self.leftLegalActions) == 0
 
+        def getOpenChildren(self):
+            """ Children the selection chooses from: proven children are skipped, except the best of them """
+            if self.solvedChildren == 0: return self.children
+            return [n for n in self.children if n.solved is None or n is self.bestSolved]
+
+        def getDepth(self):
+            depth, node = 0, self.parent
+            while node != None:
+                depth += 1
+                node = node.parent
+            return depth
+
     def setPlayer(self, player):
         self.player = player
 
     def initState(self, state):
-        self.root = None
+        self.root = None  # search tree kept between moves (see getRoot)
+        self.lastAction = None
         self.expectedValueDict = defaultdict(float)
+        if self.solver is not None: self.solver.clear()  # solver keys are valid for one board only
 
-    def __init__(self, evaluationFunction, player, timePerMove=1.0, bestChildPolicy=UCBPolicy, transpositions=True, cutLevel=None, cutFunction=None):
+    def __init__(self, evaluationFunction, player, timePerMove=1.0, bestChildPolicy=UCBPolicy, transpositions=True, cutLevel=None, cutFunction=None, rolloutFunction=None,
+                 workers=1, parallelMode="root", leafBatch=16, maxNodes=None, transpositionStore=None, iterationBudget=None, playoutBudget=None, nodeBudget=None,
+                 playoutsPerRollout=1, collectStats=False, statsCallback=None, profiler=None, solverThreshold=None, treeSolverThreshold=4,
+                 priorFunction=None, widening=None, progressiveBias=0.0):
         """
             evaluationFunction: takes state, returns an array of rewards for each player, indexed by currentPlayer field in the gameState class
             best child policy = one of the implemented best child policies included in the UCTAgent class scope
             cutLevel - level after which apply cutFunction which evaluates state :)
+            rolloutFunction - takes state, returns an array of rewards (e.g. averaged over a batch of playouts), replaces the one-by-one random playout.
+                              In RAVE mode a function with the recordsPlayed attribute set (e.g. paratroopersHeavyRolloutVector) also gets
+                              the played keyword argument (see rollout) and fills it, for other ones (e.g. batched) only the tree moves count
+            workers - number of worker processes; if > 1 each worker grows an independent tree from the root (root parallelization)
+                      and root children statistics are merged. Functions and the policy class passed to the agent have to be picklable (module level)
+            parallelMode - "root" (see above) or "leaf": one shared tree in this process, leaves selected under virtual loss
+                           are evaluated by the workers in batches of workers * leafBatch
+            maxNodes - bound on tree size; once reached the search stops expanding and only refines the existing nodes
+                       (nodeLimitHits counts refused expansions during the last search)
+            transpositionStore - transposition.TranspositionStore (used with transpositions on): statistics of new positions are loaded
+                                 from it and the entries updated by a search are saved to it at its end, within the time limit of the move.
+                                 Workers get it read-only, with root parallelization only this process stores the merged root statistics
+            timePerMove, iterationBudget, playoutBudget, nodeBudget - search stops when any of them is exhausted (None - unbounded,
+                                 ValueError if all of them are None), with root parallelization the budgets apply to each worker.
+                                 Under time control (getAction gets a deadline) the agent's share of the remaining clock replaces timePerMove
+            playoutsPerRollout - playouts done by one rollout evaluation (e.g. the batch size of a batched rolloutFunction), for playoutBudget
+            collectStats - time the search phases, record depths and transposition hits in the SearchStats of each search (agent.stats)
+            statsCallback - called with the SearchStats after every getAction
+            profiler - object with enable()/disable() (e.g. cProfile.Profile()) switched on around the search loop
+            solverThreshold - a root with at most this many free cells is solved exactly (solver.EndgameSolver), without search
+            treeSolverThreshold - (with solverThreshold) tree nodes with at most this many free cells (capped by solverThreshold)
+                                  are proven when expanded, backup propagates the proofs and selection skips proven subtrees.
+                                  Kept low - a proof of a large position costs many playouts
+            priorFunction - takes (state, action), returns a cheap prior of the action (e.g. paratroopersGainPrior);
+                            nodes expand their actions in the order of decreasing prior instead of at random
+            widening - (c, alpha): progressive widening, a node visited N times has at most max(1, c * N ** alpha) children
+                       (the best ones by prior) and is otherwise refined among them (None - all actions are expanded first)
+            progressiveBias - weight W of the progressive bias W * prior / (N + 1) added to the child scores of the UCB/RAVE policies
         """
+        if timePerMove is None and iterationBudget is None and playoutBudget is None and nodeBudget is None:
+            raise ValueError("UCTAgent needs a time limit or an iteration, playout or node budget")
         self.cutLevel = cutLevel
         self.cutFunction = cutFunction
+        self.rolloutFunction = rolloutFunction
+        self.rolloutRecordsPlayed = getattr(rolloutFunction, "recordsPlayed", False)
         self.Qdict = defaultdict(float)
         self.Ndict = defaultdict(float)
         self.transpositions = transpositions
         self.evaluationFunction = evaluationFunction
         self.timePerMove = timePerMove
         self.player = player
-        self.bestChildPolicy = bestChildPolicy.__class__
-        print self.bestChildPolicy  # mozna rozwiazac bardziej pythonowo
-        self.bestChild = bestChildPolicy().bestChild if bestChildPolicy is not None else UCTAgent.UCBPolicy().bestChild
+        self.bestChildPolicy = bestChildPolicy if bestChildPolicy is not None else UCTAgent.UCBPolicy
+        self.policy = self.bestChildPolicy()  # e.g. agent.policy.setParams(...)
+        self.bestChild = self.policy.bestChild
+        self.rave = getattr(self.policy, "amaf", False)  # collect AMAF statistics for the policy
+        self.workers = workers
+        self.parallelMode = parallelMode
+        self.leafBatch = leafBatch
+        self.pool = None  # created on first use when workers > 1
+        self.root = None
+        self.lastAction = None
+        self.maxNodes = maxNodes
+        self.nodeCount = 0
+        self.nodeLimitHits = 0
+        self.transpositionStore = transpositionStore
+        self.touchedKeys = set() if transpositions and transpositionStore is not None and not transpositionStore.readOnly else None  # keys to save
+        self.saveTime = 0.0  # duration of the last save, reserved from the time limit of the next search
+        self.warmStarts = {}  # key -> (N, Q) loaded from the transposition store, for the statistics of a search alone
+        self.iterationBudget = iterationBudget
+        self.playoutBudget = playoutBudget
+        self.nodeBudget = nodeBudget
+        self.playoutsPerRollout = playoutsPerRollout
+        self.collectStats = collectStats
+        self.statsCallback = statsCallback
+        self.profiler = profiler
+        self.stats = SearchStats()
+        self.solverThreshold = solverThreshold
+        self.treeSolverThreshold = min(treeSolverThreshold, solverThreshold) if solverThreshold is not None else None
+        self.solver = EndgameSolver() if solverThreshold is not None else None
+        self.priorFunction = priorFunction
+        self.widening = widening
+        self.progressiveBias = progressiveBias
         self.options = {}
 
-    def getAction(self, state):
+    def getAction(self, state, deadline=None):
         """ Using UCT search returns the best action """
-        self.Ndict = defaultdict(float)  # reset dictionaries
-        self.Qdict = defaultdict(float)
-        root = UCTAgent.UCTNode(copy.deepcopy(state), parentAgent=self)
-        start = time.time()
-        counter = 0
-        while True:
-            counter += 1
-            if time.time() - start >= self.timePerMove: break  # check time each 100th move
+        if self.solver is not None and len(state.getLegalActions()) <= self.solverThreshold:
+            self.root = None
+            self.nodeCount = self.nodeLimitHits = 0
+            budget = SearchBudget()  # measures the solve only
+            self.startStats()
+            self.lastAction = self.solver.solve(state)[1]  # endgame - exact and instant
+            self.finishStats(budget, [])
+            self.reportStats()
+            return self.lastAction
+        timeLimit = self.getTimeLimit(state, deadline)
+        if self.workers > 1 and self.parallelMode == "root": return self.getActionRootParallel(state, timeLimit)
+        root = self.search(state, timeLimit) if self.workers == 1 else self.searchLeafParallel(state, timeLimit)
+
+        # pick the best action based on the calculated expected values (exact ones for proven children)
+        L = [n.getExpectedValue() if n.solved is None else n.solved[self.player] for n in root.children]
+        self.lastAction = root.children[L.index(max(L))].action
+        self.reportStats()
+        return self.lastAction
+
+    def reportStats(self):
+        if self.statsCallback is not None: self.statsCallback(self.stats)
+
+    def getRoot(self, state):
+        """
+            Returns the root node for a search from state. If the previous tree contains it (our last action followed by the opponent's reply)
+            the matching grandchild becomes the new root and keeps its statistics, the rest of the old tree is dropped
+            (together with the transposition statistics of positions no longer in the tree)
+        """
+        root = None
+        if self.root is not None:
+            for child in self.root.children:
+                if child.action == self.lastAction:
+                    root = next((n for n in child.children if n.state == state), None)
+                    break
+        if root is None:
+            self.Ndict = defaultdict(float)  # reset dictionaries
+            self.Qdict = defaultdict(float)
+            self.warmStarts = {}
+            root = UCTAgent.UCTNode(state.clone(), parentAgent=self)
+        elif self.transpositions:
+            self.pruneTranspositions(root)
+        root.parent = None
+        self.root = root
+        self.nodeCount = self.countNodes(root)
+        self.nodeLimitHits = 0
+        return root
+
+    def pruneTranspositions(self, root):
+        """ Rebuilds the transposition dictionaries from the keys of the subtree of root """
+        Ndict, Qdict = defaultdict(float), defaultdict(float)
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.key in self.Ndict:
+                Ndict[node.key] = self.Ndict[node.key]
+                Qdict[node.key] = self.Qdict[node.key]
+            stack.extend(node.children)
+        self.Ndict, self.Qdict = Ndict, Qdict
+        self.warmStarts = dict((key, stored) for key, stored in self.warmStarts.iteritems() if key in Ndict)
+
+    def countNodes(self, root):
+        """ Returns number of nodes in the subtree of root """
+        count, stack = 0, [root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+    def getTimeLimit(self, state, deadline):
+        """ Thinking time for this move: timePerMove, or under time control (deadline given) the share of the remaining clock """
+        if deadline is None: return self.timePerMove
+        movesLeft = (len(state.getLegalActions()) + 1) // 2  # moves alternate, we make every other one
+        return deadline.allocate(movesLeft)
+
+    def newBudget(self, timeLimit=None):
+        """ Search budget, timeLimit overrides timePerMove; the time of saving transpositions is taken from it (at most a half) """
+        if timeLimit is None: timeLimit = self.timePerMove
+        if timeLimit is not None and self.touchedKeys is not None: timeLimit = max(timeLimit / 2.0, timeLimit - self.saveTime)
+        return SearchBudget(timeLimit, self.iterationBudget, self.playoutBudget, self.nodeBudget)
+
+    def startStats(self):
+        """ Starts statistics (and profiling) of a new search """
+        self.stats = SearchStats(self.collectStats)
+        self.stats.profile = self.profiler
+        if self.profiler is not None: self.profiler.enable()
+        return self.stats
+
+    def finishStats(self, budget, rootVisits):
+        """ Stops profiling, fills in the totals of the search """
+        if self.profiler is not None: self.profiler.disable()
+        stats = self.stats
+        stats.selectionTime -= stats.expansionTime  # expansion is timed inside the tree policy
+        stats.elapsed = time.time() - budget.start
+        stats.iterations, stats.playouts = budget.iterations, budget.playouts
+        stats.nodeCount, stats.nodeLimitHits = self.nodeCount, self.nodeLimitHits
+        stats.rootVisits = [(action, N, Q / N) for action, N, Q in rootVisits]
+
+    def search(self, state, timeLimit=None):
+        """ Runs UCT search from state until the budget is exhausted, returns the root node """
+        root = self.getRoot(state)
+        budget = self.newBudget(timeLimit)
+        stats = self.startStats()
+        clock = stats.clock
+        while root.solved is None and not budget.isExhausted(self.nodeCount):
+            t0 = clock()
             v = self.treePolicy(root)
-            evaluation = self.defaultPolicy(v)
-            self.backup(v, evaluation)
+            t1 = clock()
+            played = [0, 0, 0] if self.rave else None
+            evaluation = self.defaultPolicy(v, played)
+            t2 = clock()
+            self.backup(v, evaluation, played=played)
+            stats.backupTime += clock() - t2
+            stats.rolloutTime += t2 - t1
+            stats.selectionTime += t1 - t0
+            if stats.timed: stats.addDepth(v.getDepth())
+            budget.count(1, self.playoutsPerRollout)
+        self.saveTranspositions()
+        self.finishStats(budget, self.getRootStatistics(root))
+        return root
+
+    def warmStart(self, key):
+        """ Loads statistics of a position (transposition key) seen for the first time from the persistent transposition store """
+        if key not in self.Ndict:
+            stored = self.transpositionStore.lookup(key, self.player)
+            if stored is not None: self.Ndict[key], self.Qdict[key] = self.warmStarts[key] = stored
+
+    def saveTranspositions(self):
+        """ Saves the transposition statistics updated since the last save to the persistent transposition store (if writable) """
+        if self.touchedKeys is None: return
+        start = time.time()
+        for key in self.touchedKeys:
+            N = self.Ndict.get(key, 0)
+            if N > 0: self.transpositionStore.store(key, self.player, N, self.Qdict[key])
+        self.transpositionStore.flush()
+        self.touchedKeys.clear()
+        self.saveTime = time.time() - start
+
+    def searchLeafParallel(self, state, timeLimit=None):
+        """
+            Leaf parallelization: like search, but selects a batch of leaves (virtual loss spreads the selections),
+            evaluates them in the worker pool and backs up the results, returns the root node
+        """
+        root = self.getRoot(state)
+        pool = self.getPool()
+        budget = self.newBudget(timeLimit)
+        stats = self.startStats()
+        clock = stats.clock
+        while root.solved is None and not budget.isExhausted(self.nodeCount):
+            leaves = []
+            t0 = clock()
+            for _ in xrange(self.workers * self.leafBatch):
+                v = self.treePolicy(root)
+                self.addVirtualLoss(v)
+                leaves.append(v)
+                if stats.timed: stats.addDepth(v.getDepth())
+            t1 = clock()
+            tasks = [(v.state, random.getrandbits(32)) for v in leaves if v.solved is None]  # proven leaves need no evaluation
+            evaluations = iter(pool.map(_leafEvaluate, tasks, chunksize=self.leafBatch))
+            t2 = clock()
+            for v in leaves:
+                self.backup(v, v.solved if v.solved is not None else next(evaluations), virtualLoss=True, played=[0, 0, 0] if self.rave else None)
+            stats.backupTime += clock() - t2
+            stats.rolloutTime += t2 - t1
+            stats.selectionTime += t1 - t0
+            budget.count(len(leaves), len(leaves) * self.playoutsPerRollout)
+        self.saveTranspositions()
+        self.finishStats(budget, self.getRootStatistics(root))
+        return root
+
+    def addVirtualLoss(self, node):
+        """ Counts a visit with zero reward on the path to the root, so that pending leaves look worse to the next selections """
+        while node != None:
+            node.addExpanded()
+            node = node.parent
 
-        # pick the best action based on the calculated expected values
-        L = [n.getExpectedValue() for n in root.children]
-        print "{0}".format(root.getExpanded())
-        return root.children[L.index(max(L))].action
+    def getPool(self):
+        """ Returns the worker pool, creates it on first use """
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, initializer=_initWorker, initargs=(self.getConfig(),))
+        return self.pool
+
+    def getActionRootParallel(self, state, timeLimit=None):
+        """ Root parallelization: each worker searches its own tree, visit counts and values of root children are summed """
+        tasks = [(state, self.player, timeLimit, random.getrandbits(32)) for _ in xrange(self.workers)]
+        merged = {}  # action -> [N, Q]
+        budget = self.newBudget(timeLimit)
+        self.startStats()
+        for statistics in self.getPool().map(_rootParallelSearch, tasks, chunksize=1):
+            for action, N, Q in statistics:
+                total = merged.setdefault(action, [0.0, 0.0])
+                total[0] += N
+                total[1] += Q
+        budget.count(int(sum(N for N, Q in merged.itervalues())), 0)
+        self.saveRootStatistics(state, merged)
+        self.finishStats(budget, [(action, N, Q) for action, (N, Q) in merged.iteritems()])
+        self.lastAction = max(merged, key=lambda action: merged[action][1] / merged[action][0])
+        self.reportStats()
+        return self.lastAction
+
+    def saveRootStatistics(self, state, merged):
+        """
+            Root parallelization: adds the merged statistics of this search (action -> [N, Q]) of the root children
+            to the ones in the persistent transposition store and saves the totals
+        """
+        if self.touchedKeys is None: return
+        for action, (N, Q) in merged.iteritems():
+            key = state.result(action).transpositionKey()
+            storedN, storedQ = self.transpositionStore.lookup(key, self.player) or (0.0, 0.0)
+            self.transpositionStore.store(key, self.player, storedN + N, storedQ + Q)
+        self.transpositionStore.flush()
+
+    def getRootStatistics(self, root, searchOnly=False):
+        """
+            Returns list of (action, N, Q) for expanded root children, Q is the accumulated (not averaged) value
+            searchOnly - without the statistics loaded from the transposition store (visits of this search only)
+        """
+        statistics = []
+        for n in root.children:
+            N = n.getExpanded()
+            Q = n.getExpectedValue() * N if N > 0 else 0.0
+            if searchOnly and n.key in self.warmStarts:
+                storedN, storedQ = self.warmStarts[n.key]
+                N, Q = N - storedN, Q - storedQ
+            if N > 0: statistics.append((n.action, N, Q))
+        return statistics
+
+    def getConfig(self):
+        """ Picklable constructor arguments used to build the agent replicas in worker processes, plus the policy parameters (policyParams) """
+        return dict(evaluationFunction=self.evaluationFunction, player=self.player, timePerMove=self.timePerMove, bestChildPolicy=self.bestChildPolicy,
+                    transpositions=self.transpositions, cutLevel=self.cutLevel, cutFunction=self.cutFunction, rolloutFunction=self.rolloutFunction,
+                    maxNodes=self.maxNodes, iterationBudget=self.iterationBudget, playoutBudget=self.playoutBudget,
+                    nodeBudget=self.nodeBudget, playoutsPerRollout=self.playoutsPerRollout, collectStats=self.collectStats,
+                    solverThreshold=self.solverThreshold, treeSolverThreshold=self.treeSolverThreshold, priorFunction=self.priorFunction,
+                    widening=self.widening, progressiveBias=self.progressiveBias,
+                    transpositionStore=self.transpositionStore.asReadOnly() if self.transpositionStore is not None else None,
+                    policyParams=dict(vars(self.policy)))  # set by agent.policy.setParams, attribute names match its arguments
+
+    def final(self, state):
+        """ End of the game - the worker pool is not needed until the next one """
+        self.closeWorkers()
+
+    def closeWorkers(self):
+        """ Terminates the worker pool (if any) """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
 
     def expand(self, node):
         """
             UCT Method: Expands one node ahead by picking a random action
             assumes that actions are randomly permuted (fast picking)
         """
+        start = self.stats.clock()
         leftLegalActions = node.leftLegalActions
+        if self.rave and node.amafN is not None: self.pickAMAFFirst(node)
         action = node.leftLegalActions.pop()
-        expanded = node.state.result(action)  # deep-copied new state alternated after the chosen (at random) action
+        expanded = node.state.result(action)  # cloned new state alternated after the chosen (at random) action
         child = UCTAgent.UCTNode(expanded, action, parentAgent=self)
         child.parent = node
+        if self.priorFunction is not None: child.prior = self.priorFunction(node.state, action)
         node.children.append(child)
+        self.nodeCount += 1
+        if self.solver is not None and len(child.leftLegalActions) <= self.treeSolverThreshold:
+            self.markSolved(child, self.evaluationFunction(self.solver.playOut(child.state)))
+        if self.stats.timed:
+            if self.transpositions:
+                self.stats.transpositionLookups += 1
+                if self.Ndict.get(child.key, 0) > 0: self.stats.transpositionHits += 1
+            self.stats.expansionTime += self.stats.clock() - start
         return child
 
+    def markSolved(self, node, evaluation):
+        """ Marks node as proven with exact evaluation, nothing below it needs to be searched any more """
+        node.solved = evaluation
+        node.leftLegalActions = []
+        parent = node.parent
+        if parent is not None:
+            parent.solvedChildren += 1
+            player = parent.state.currentPlayer
+            if parent.bestSolved is None or evaluation[player] > parent.bestSolved.solved[player]: parent.bestSolved = node
+
     def treePolicy(self, node):
         """ UCT method: Expand given node in the game tree down to the leaves """
-        while not node.isTerminal():
-            if not node.isFullyExpanded():
-                return self.expand(node)
-            else:
-                node = self.bestChild(node)
+        while node.solved is None and not node.isTerminal():
+            if not node.isFullyExpanded() and self.canWiden(node):
+                if self.maxNodes is None or self.nodeCount < self.maxNodes:
+                    return self.expand(node)
+                self.nodeLimitHits += 1  # tree is full - continue among the already expanded children
+                if not node.children: return node
+            node = self.bestChild(node)
 
         return node
 
+    def canWiden(self, node):
+        """ Progressive widening: may node get another child (the next best by prior) at its visit count """
+        if self.widening is None or not node.children: return True
+        c, alpha = self.widening
+        return len(node.children) < max(1, int(c * node.getExpanded() ** alpha))
+
     def pickMovePolicy(self, state):
         """ Policy for picking next move in tree search, currently - at random """
         return random.choice(state.getLegalActions())
 
+    def defaultPolicy(self, node, played=None):
+        """ UCT method: Expand given node in the tree search game, played - see rollout """
+        if node.solved is not None: return node.solved
+        return self.rollout(node.state, played)
+
     # TODO: without result
-    def defaultPolicy(self, node):
-        """ UCT method: Expand given node in the tree search game """
-        default_node = copy.deepcopy(node.state)  # (state, parent)
+    def rollout(self, state, played=None):
+        """ Evaluates state by simulation (state is not modified), played - if given, played[player] collects bits of the cells player took """
+        if self.rolloutFunction is not None and not state.isTerminal():
+            return self.rolloutFunction(state, played=played) if played is not None and self.rolloutRecordsPlayed else self.rolloutFunction(state)
+        default_node = state.clone()  # (state, parent)
         simulation_depth = 0
         while not default_node.isTerminal():
             if self.cutFunction != None and self.cutLevel == simulation_depth: return self.cutFunction(default_node)
-            default_node = default_node.result(self.pickMovePolicy(default_node), copyState=False)  # keep this node
+            action = self.pickMovePolicy(default_node)
+            if played is not None: played[default_node.currentPlayer] |= 1 << action
+            default_node = default_node.result(action, copyState=False)  # keep this node
             simulation_depth += 1
         #             if simulation_depth > 1: return self.evaluationFunction(default_node)
 
         return self.evaluationFunction(default_node)
 
-    def backup(self, node, evaluation):
-        """ UCT method: backup new evaluation """
+    def backup(self, node, evaluation, virtualLoss=False, played=None):
+        """
+            UCT method: backup new evaluation, virtualLoss - visits were already counted by addVirtualLoss
+            played - (RAVE mode) cells taken in the playout (see rollout), with the moves on the path they update AMAF statistics
+        """
         last_node = None
         while node != None:
+            if played is not None: self.updateAMAF(node, evaluation[self.player], played)
+            if self.touchedKeys is not None: self.touchedKeys.add(node.key)
             node.addExpectedValue(evaluation[self.player])
-            node.addExpanded()
+            if not virtualLoss: node.addExpanded()
 
             ### PERFORMANCE ISSUES - DYNAMIC CALCULATION OF NODE BEST CHILD ###
             if node.parent != None and node.getExpectedValue() > node.parent.best_child[0]: node.parent.best_child = (node.Q, node)  # update best child pointer # tez moze byc zle
+            if node.solved is None and node.solvedChildren == len(node.children) > 0 and node.isFullyExpanded():
+                self.markSolved(node, node.bestSolved.solved)  # all children proven - so is the node
             last_node = node
             node = node.parent
 
+    def pickAMAFFirst(self, node):
+        """ RAVE mode: moves the untried action with the best AMAF value to the end of leftLegalActions (expanded next) """
+        actions, amafN, amafQ = node.leftLegalActions, node.amafN, node.amafQ
+        L = [amafQ[action] / amafN[action] if amafN.get(action) else -1.0 for action in actions]
+        best = L.index(max(L))
+        actions[best], actions[-1] = actions[-1], actions[best]
+
+    def updateAMAF(self, node, value, played):
+        """ Adds the move into node to played, updates AMAF statistics of every cell its parent's player to move took from there on """
+        parent = node.parent
+        if parent is None: return
+        player = parent.state.currentPlayer
+        played[player] |= 1 << node.action
+        if parent.amafN is None:
+            parent.amafN = defaultdict(float)
+            parent.amafQ = defaultdict(float)
+        amafN, amafQ = parent.amafN, parent.amafQ
+        cells = played[player]
+        while cells:
+            cell = cells & -cells
+            action = cell.bit_length() - 1
+            amafN[action] += 1
+            amafQ[action] += value
+            cells ^= cell
+
+
+class UCTArrayTree(object):
+    """
+        Struct-of-arrays storage of a UCT tree: node i is described by the i-th entry of each typed array.
+        Children of a node are allocated together as one contiguous slice [firstChild, firstChild + childCount).
+        Arrays grow by doubling (never beyond maxSize, if given) and are reused between searches (reset keeps the capacity).
+    """
+
+    def __init__(self, capacity=4096, maxSize=None):
+        self.maxSize = maxSize
+        self.capacity = capacity if maxSize is None else min(capacity, maxSize)
+        self.size = 0
+        self.N = array('d', [0.0]) * self.capacity
+        self.Q = array('d', [0.0]) * self.capacity
+        self.parent = array('l', [0]) * self.capacity
+        self.firstChild = array('l', [0]) * self.capacity  # -1 until the children slice is allocated
+        self.childCount = array('l', [0]) * self.capacity
+        self.expandedCount = array('l', [0]) * self.capacity  # children [firstChild, firstChild + expandedCount) have been visited
+        self.action = array('l', [0]) * self.capacity  # action leading from the parent to the node
+
+    def reset(self):
+        self.size = 0
+
+    def allocate(self, parent, actions):
+        """ Appends one node per action as children of parent, returns index of the first one or -1 if maxSize would be exceeded """
+        if self.maxSize is not None and self.size + len(actions) > self.maxSize: return -1
+        start = self.size
+        self.size += len(actions)
+        while self.size > self.capacity: self._grow()
+        for i, action in enumerate(actions):
+            node = start + i
+            self.N[node] = self.Q[node] = 0.0
+            self.parent[node] = parent
+            self.firstChild[node] = -1
+            self.childCount[node] = self.expandedCount[node] = 0
+            self.action[node] = action
+        return start
+
+    def _grow(self):
+        extra = self.capacity if self.maxSize is None else min(self.capacity, self.maxSize - self.capacity)
+        for name in ('N', 'Q', 'parent', 'firstChild', 'childCount', 'expandedCount', 'action'):
+            column = getattr(self, name)
+            column.extend(array(column.typecode, [0]) * extra)
+        self.capacity += extra
+
+
+class UCTArrayAgent(UCTAgent):
+    """
+        UCT agent using the struct-of-arrays tree (UCTArrayTree) instead of UCTNode objects.
+        Nodes don't store states - the state of a node is replayed from the root while descending, which keeps
+        memory per node at a few array slots. Uses UCB1 selection (C of UCBPolicy), no transpositions, one process.
+        With maxNodes the arrays never grow beyond maxNodes slots.
+    """
+
+    def __init__(self, evaluationFunction, player, timePerMove=1.0, cutLevel=None, cutFunction=None, rolloutFunction=None, capacity=4096, maxNodes=None,
+                 iterationBudget=None, playoutBudget=None, nodeBudget=None, playoutsPerRollout=1, collectStats=False, statsCallback=None, profiler=None):
+        UCTAgent.__init__(self, evaluationFunction, player, timePerMove, UCTAgent.UCBPolicy, transpositions=False, cutLevel=cutLevel, cutFunction=cutFunction,
+                          rolloutFunction=rolloutFunction, maxNodes=maxNodes, iterationBudget=iterationBudget, playoutBudget=playoutBudget,
+                          nodeBudget=nodeBudget, playoutsPerRollout=playoutsPerRollout, collectStats=collectStats, statsCallback=statsCallback,
+                          profiler=profiler)
+        self.C = UCTAgent.UCBPolicy.C
+        self.tree = UCTArrayTree(capacity, maxNodes)
+
+    def getAction(self, state, deadline=None):
+        """ Using UCT search returns the best action """
+        tree = self.search(state, self.getTimeLimit(state, deadline))
+        start, count = tree.firstChild[0], tree.expandedCount[0]
+        L = [tree.Q[n] / tree.N[n] for n in xrange(start, start + count)]
+        self.lastAction = tree.action[start + L.index(max(L))]
+        self.reportStats()
+        return self.lastAction
+
+    def search(self, state, timeLimit=None):
+        """ Runs UCT search from state until the budget is exhausted, returns the tree (root is node 0) """
+        tree = self.tree
+        tree.reset()
+        tree.allocate(-1, [-1])  # root
+        self.nodeLimitHits = 0
+        budget = self.newBudget(timeLimit)
+        stats = self.startStats()
+        clock = stats.clock
+        while not budget.isExhausted(tree.size):
+            t0 = clock()
+            node, leafState = self.treePolicy(state)  # selection time includes the expansion
+            t1 = clock()
+            evaluation = self.rollout(leafState)
+            t2 = clock()
+            self.backup(node, evaluation)
+            stats.backupTime += clock() - t2
+            stats.rolloutTime += t2 - t1
+            stats.selectionTime += t1 - t0
+            if stats.timed: stats.addDepth(self.getDepth(node))
+            budget.count(1, self.playoutsPerRollout)
+        self.nodeCount = tree.size
+        start = tree.firstChild[0]
+        self.finishStats(budget, [(tree.action[n], tree.N[n], tree.Q[n]) for n in xrange(start, start + tree.expandedCount[0])] if start >= 0 else [])
+        return tree
+
+    def getDepth(self, node):
+        depth = 0
+        while self.tree.parent[node] >= 0:
+            depth += 1
+            node = self.tree.parent[node]
+        return depth
+
+    def treePolicy(self, state):
+        """ Descends from the root replaying actions on a copy of state, expands one node, returns (node, its state) """
+        tree = self.tree
+        node = 0
+        state = state.clone()
+        while not state.isTerminal():
+            if tree.firstChild[node] < 0:
+                actions = state.getLegalActions()
+                random.shuffle(actions)  # expansion order
+                first = tree.allocate(node, actions)
+                if first < 0:  # tree is full - evaluate this node as a leaf
+                    self.nodeLimitHits += 1
+                    return node, state
+                tree.firstChild[node] = first
+                tree.childCount[node] = len(actions)
+            if tree.expandedCount[node] < tree.childCount[node]:
+                child = tree.firstChild[node] + tree.expandedCount[node]
+                tree.expandedCount[node] += 1
+                return child, state.result(tree.action[child], copyState=False)
+            node = self.bestChildIndex(node)
+            state.result(tree.action[node], copyState=False)
+        return node, state
+
+    def bestChildIndex(self, node):
+        """ UCB1 over the (fully expanded) children slice of node """
+        tree = self.tree
+        start, end = tree.firstChild[node], tree.firstChild[node] + tree.childCount[node]
+        logN = 2 * math.log(tree.N[node])
+        if numpy is not None:
+            N = numpy.frombuffer(tree.N, dtype=numpy.float64)[start:end]
+            Q = numpy.frombuffer(tree.Q, dtype=numpy.float64)[start:end]
+            return start + int((Q / N + self.C * numpy.sqrt(logN / N)).argmax())
+        L = [tree.Q[n] / tree.N[n] + self.C * math.sqrt(logN / tree.N[n]) for n in xrange(start, end)]
+        return start + L.index(max(L))
+
+    def backup(self, node, evaluation, virtualLoss=False):
+        """ UCT method: backup new evaluation """
+        tree = self.tree
+        value = evaluation[self.player]
+        while node >= 0:
+            tree.N[node] += 1
+            tree.Q[node] += value
+            node = tree.parent[node]
+
+
+# module level names of the policies - pickle finds a class by its module and name, so worker configs can carry the policy class
+UCBPolicyMod, UCBPolicy, EGreedyPolicy, RAVEPolicy = UCTAgent.UCBPolicyMod, UCTAgent.UCBPolicy, UCTAgent.EGreedyPolicy, UCTAgent.RAVEPolicy
+
+_workerAgent = None  # agent replica living in a worker process
+
+
+def _initWorker(config):
+    """ Worker process initializer, builds the agent replica from getConfig() output """
+    global _workerAgent
+    config = dict(config)
+    policyParams = config.pop("policyParams")
+    _workerAgent = UCTAgent(**config)
+    _workerAgent.policy.setParams(**policyParams)
+
+
+def _reseed(seed):
+    """ Forked workers inherit the parent's random generators, give each task its own stream """
+    random.seed(seed)
+    if "numpy" in sys.modules: sys.modules["numpy"].random.seed(seed)
+
+
+def _rootParallelSearch(task):
+    """ Worker task: independent search from the root, returns root children statistics gathered by this search (warm starts left out) """
+    state, player, timeLimit, seed = task
+    _reseed(seed)
+    _workerAgent.setPlayer(player)
+    return _workerAgent.getRootStatistics(_workerAgent.search(state, timeLimit), searchOnly=True)
+
+
+def _leafEvaluate(task):
+    """ Worker task: rollout of a single leaf state """
+    state, seed = task
+    _reseed(seed)
+    return _workerAgent.rollout(state)
+
 
 def testUCTExpand():
     import paratroopers
@@ -0,0 +1,92 @@
+"""
+Anytime alpha-beta agent: iterative deepening negamax with a Zobrist keyed transposition table
+A cheap per decision baseline for benchmarking UCT configurations on small and medium boards
+"""
+import time
+
+from game import Agent
+from paratroopers import ParatroopersGame
+from solver import EXACT, LOWER, UPPER, INFINITY, orderedChildren
+
+
+class _SearchTimeout(Exception):
+    """ Raised inside the search when the time of the move is up """
+    pass
+
+
+class AlphaBetaAgent(Agent):
+    """
+        Searches 1, 2, 3... plies deep until the time is up, the move of the deepest finished iteration is played
+        Moves are ordered by the table's best move, then by immediate gain (cell value plus captures)
+    """
+    CLOCK_CHECK = 256  # nodes between clock reads
+
+    def __init__(self, heuristic, player, timePerMove=1.0, maxDepth=None, maxEntries=1 << 20):
+        """
+            heuristic: takes (state, player), returns his reward (e.g. greedyHeuristic), positions are evaluated by the difference of both players' rewards
+            maxDepth - stop deepening at this depth (None - only the time and the end of the game stop it)
+            maxEntries - the transposition table is cleared when it grows beyond this size
+        """
+        self.heuristic = heuristic
+        self.player = player
+        self.timePerMove = timePerMove
+        self.maxDepth = maxDepth
+        self.maxEntries = maxEntries
+        self.table = {}  # key -> (depth, value, kind, best action)
+        self.nodes = 0  # positions visited during the last move
+        self.depthReached = 0  # depth of the last finished iteration
+
+    def initState(self, state):
+        """ Register initial state, the table is valid for one board only """
+        self.table = {}
+
+    def getTimeLimit(self, state, deadline):
+        """ timePerMove, or under time control (deadline given) the share of the remaining clock """
+        if deadline is None: return self.timePerMove
+        return deadline.allocate((len(state.getLegalActions()) + 1) // 2)
+
+    def getAction(self, state, deadline=None):
+        self.end = time.time() + self.getTimeLimit(state, deadline)
+        self.nodes = 0
+        self.depthReached = 0
+        if len(self.table) > self.maxEntries: self.table = {}
+        freeCells = len(state.getLegalActions())
+        maxDepth = freeCells if self.maxDepth is None else min(self.maxDepth, freeCells)
+        bestAction = orderedChildren(state)[0][1]  # fallback if not even depth 1 finishes
+        for depth in xrange(1, maxDepth + 1):
+            try:
+                self._negamax(state, depth, -INFINITY, INFINITY)
+            except _SearchTimeout:
+                break
+            bestAction = self.table[state.key][3]
+            self.depthReached = depth
+        return bestAction
+
+    def evaluate(self, state):
+        """ Heuristic value from the point of view of the player to move """
+        value = self.heuristic(state, ParatroopersGame.PLAYER1) - self.heuristic(state, ParatroopersGame.PLAYER2)
+        return value if state.currentPlayer == ParatroopersGame.PLAYER1 else -value
+
+    def _negamax(self, state, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes % AlphaBetaAgent.CLOCK_CHECK == 0 and time.time() >= self.end: raise _SearchTimeout()
+        if depth == 0 or state.isTerminal(): return self.evaluate(state)
+        entry = self.table.get(state.key)
+        bestAction = None
+        if entry is not None:
+            entryDepth, value, kind, bestAction = entry
+            if entryDepth >= depth:
+                if kind == EXACT: return value
+                if kind == LOWER: alpha = max(alpha, value)
+                else: beta = min(beta, value)
+                if alpha >= beta: return value
+        originalAlpha = alpha
+        best = -INFINITY
+        for child, action in orderedChildren(state, bestAction):
+            value = -self._negamax(child, depth - 1, -beta, -alpha)
+            if value > best: best, bestAction = value, action
+            if best > alpha: alpha = best
+            if alpha >= beta: break
+        kind = UPPER if best <= originalAlpha else LOWER if best >= beta else EXACT
+        self.table[state.key] = (depth, best, kind, bestAction)
+        return best
@@ -0,0 +1,187 @@
+"""
+Micro- and macro-benchmarks of the game engine and UCT
+Usage: python benchmark.py [--sizes 3-12] [--time 0.5] [--repeats 3] [--output baseline.json] [--compare baseline.json] [--threshold 0.1]
+Every metric is the best of the repeated measurements, which keeps the noise of a busy machine out of the comparison
+"""
+from optparse import OptionParser
+import json
+import platform
+import random
+import sys
+import time
+
+import UCT
+from paratroopers import ParatroopersGame, randomBoard, paratroopersGreedyHeuristicVector
+
+# metric -> True if higher is better
+METRICS = {"result_ns": False, "getLegalActions_ns": False, "rollouts_per_s": True, "bytes_per_node": False, "bytes_per_array_node": False}
+POLICIES = [UCT.UCTAgent.UCBPolicy, UCT.UCTAgent.UCBPolicyMod, UCT.UCTAgent.EGreedyPolicy]
+for _policy in POLICIES:
+    METRICS["iterations_per_s_" + _policy.__name__] = True
+METRICS["iterations_per_s_UCTArrayAgent"] = True
+
+
+def _midGameStates(game, count):
+    """ Random positions with about half of the board filled """
+    states = []
+    for _ in xrange(count):
+        state = game.gameState
+        for _ in xrange(game.K ** 2 // 2):
+            state = state.result(random.choice(state.getLegalActions()))
+        states.append(state)
+    return states
+
+
+def _timeCalls(function, arguments, duration):
+    """ Calls function on arguments (cycling) for about duration seconds, returns ns per call """
+    calls = 0
+    start = time.time()
+    while True:
+        for argument in arguments:
+            function(argument)
+        calls += len(arguments)
+        elapsed = time.time() - start
+        if elapsed >= duration: return elapsed * 1e9 / calls
+
+
+def benchResult(game, duration):
+    states = _midGameStates(game, 64)
+    pairs = [(state, random.choice(state.getLegalActions())) for state in states]
+    return _timeCalls(lambda pair: pair[0].result(pair[1]), pairs, duration)
+
+
+def benchGetLegalActions(game, duration):
+    return _timeCalls(lambda state: state.getLegalActions(), _midGameStates(game, 64), duration)
+
+
+def benchRollouts(game, duration):
+    agent = UCT.UCTAgent(paratroopersGreedyHeuristicVector, ParatroopersGame.PLAYER1, transpositions=False)
+    rollouts = 0
+    start = time.time()
+    while time.time() - start < duration:
+        agent.rollout(game.gameState)
+        rollouts += 1
+    return rollouts / (time.time() - start)
+
+
+def benchIterations(game, duration, policy):
+    agent = UCT.UCTAgent(paratroopersGreedyHeuristicVector, ParatroopersGame.PLAYER1, duration, policy, transpositions=False)
+    agent.initState(game.gameState)
+    start = time.time()
+    root = agent.search(game.gameState)
+    return root.N / (time.time() - start)
+
+
+def benchArrayIterations(game, duration):
+    agent = UCT.UCTArrayAgent(paratroopersGreedyHeuristicVector, ParatroopersGame.PLAYER1, duration)
+    start = time.time()
+    tree = agent.search(game.gameState)
+    return tree.N[0] / (time.time() - start)
+
+
+def _nodeSize(node):
+    """ Bytes owned by one UCTNode (the node, its containers and its state) """
+    state = node.state
+    owned = [node, node.__dict__, node.children, node.leftLegalActions, node.expectedValueDict, node.best_child, node.best_child_UCB1,
+             state, state.playerMask, state.rewardPlayer]
+    if state.symKeys is not None: owned.append(state.symKeys)
+    return sum(sys.getsizeof(o) for o in owned) + sum(sys.getsizeof(action) for action in node.leftLegalActions)
+
+
+def benchNodeMemory(game, nodes=2000):
+    agent = UCT.UCTAgent(paratroopersGreedyHeuristicVector, ParatroopersGame.PLAYER1, None, transpositions=False, nodeBudget=nodes)
+    agent.initState(game.gameState)
+    root = agent.search(game.gameState)
+    total, count, stack = 0, 0, [root]
+    while stack:
+        node = stack.pop()
+        total += _nodeSize(node)
+        count += 1
+        stack.extend(node.children)
+    return float(total) / count
+
+
+def benchArrayNodeMemory(game, nodes=2000):
+    """ Bytes of array slots per visited node after a search - a node reserves slots for all its children when it is first expanded """
+    agent = UCT.UCTArrayAgent(paratroopersGreedyHeuristicVector, ParatroopersGame.PLAYER1, None, iterationBudget=nodes)
+    tree = agent.search(game.gameState)
+    slotBytes = sum(getattr(tree, name).itemsize for name in ('N', 'Q', 'parent', 'firstChild', 'childCount', 'expandedCount', 'action'))
+    visited = 1 + sum(tree.expandedCount[node] for node in xrange(tree.size))  # root and every child picked by the tree policy
+    return float(tree.size * slotBytes) / visited
+
+
+def runBenchmarks(sizes, duration, log=sys.stderr, repeats=3):
+    """ Returns {K: {metric: best of repeats values}} for every board size """
+    results = {}
+    for K in sizes:
+        random.seed(K)
+        game = ParatroopersGame(K, randomBoard(K))
+        measures = {"result_ns": lambda: benchResult(game, duration), "getLegalActions_ns": lambda: benchGetLegalActions(game, duration),
+                    "rollouts_per_s": lambda: benchRollouts(game, duration), "bytes_per_node": lambda: benchNodeMemory(game),
+                    "bytes_per_array_node": lambda: benchArrayNodeMemory(game),
+                    "iterations_per_s_UCTArrayAgent": lambda: benchArrayIterations(game, duration)}
+        for policy in POLICIES:
+            measures["iterations_per_s_" + policy.__name__] = lambda policy=policy: benchIterations(game, duration, policy)
+        metrics = {}
+        for _ in xrange(repeats):  # rounds over all metrics, so that a burst of load on the machine doesn't spoil every sample of one metric
+            for metric, measure in sorted(measures.items()):
+                value = measure()
+                better = max if METRICS[metric] else min  # METRICS tells which direction is better
+                metrics[metric] = better(metrics[metric], value) if metric in metrics else value
+        results[str(K)] = metrics
+        log.write("K={0}: {1}\n".format(K, json.dumps(metrics, sort_keys=True)))
+    return results
+
+
+def compare(baseline, current, threshold):
+    """ Returns list of (K, metric, baseline value, current value) that regressed by more than threshold (relative) """
+    regressions = []
+    for K, metrics in sorted(current.items(), key=lambda item: int(item[0])):
+        for metric, value in sorted(metrics.items()):
+            old = baseline.get(K, {}).get(metric)
+            if old is None or old == 0: continue
+            change = (value - old) / float(old)
+            if (METRICS[metric] and change < -threshold) or (not METRICS[metric] and change > threshold):
+                regressions.append((K, metric, old, value))
+    return regressions
+
+
+def parseSizes(description):
+    """ "3-12" or "4,6,8" -> list of board sizes """
+    if '-' in description:
+        low, high = description.split('-')
+        return range(int(low), int(high) + 1)
+    return [int(K) for K in description.split(',')]
+
+
+def create_parser():
+    """ Configure options and return parser object """
+    parser = OptionParser()
+    parser.add_option("-k", "--sizes", type="string", default="3-12", dest="sizes", help="Board sizes, e.g. 3-12 or 4,6,8, default is 3-12")
+    parser.add_option("-t", "--time", type="float", default=0.5, dest="time", help="Time of each measurement in seconds, default is 0.5")
+    parser.add_option("-r", "--repeats", type="int", default=3, dest="repeats", help="Measurements of each metric, the best one is reported, default is 3")
+    parser.add_option("-o", "--output", type="string", default=None, dest="output", help="Write results as JSON baseline to this file")
+    parser.add_option("-c", "--compare", type="string", default=None, dest="compare", help="Compare results with this JSON baseline")
+    parser.add_option("--threshold", type="float", default=0.1, dest="threshold", help="Relative change counted as regression, default is 0.1")
+    return parser
+
+
+def main():
+    (options, args) = create_parser().parse_args()
+    results = {"meta": {"python": platform.python_version(), "machine": platform.machine(), "time": options.time, "repeats": options.repeats},
+               "results": runBenchmarks(parseSizes(options.sizes), options.time, repeats=options.repeats)}
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.compare is not None:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline["results"], results["results"], options.threshold)
+        for K, metric, old, new in regressions:
+            print "REGRESSION K={0} {1}: {2:.1f} -> {3:.1f}".format(K, metric, old, new)
+        print "{0} regression(s) beyond {1:.0%}".format(len(regressions), options.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
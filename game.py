@@ -18,9 +18,14 @@ class Agent:
         """ Registers the initial state, optional """
         pass
 
-    def getAction(self, state):
+    def final(self, state):
+        """ Called with the last state when the game ends (also on a loss on time), optional - e.g. to release worker processes """
+        pass
+
+    def getAction(self, state, deadline=None):
         """
         The Agent will receive a GameState (from either {pacman, capture, sonar}.py) and
         must return an action from Directions.{North, South, East, West, Stop}
+        deadline: timecontrol.Deadline of the move (None - no time control), the agent should return before it expires
         """
         raiseNotDefined()
@@ -2,32 +2,120 @@
 Game Logic for Paratroopers
 """
 import copy
-import pygame
+import hashlib
 import time
 import random
 
 import UCT
 from config import square_size, margin
 from game import Agent
+import timecontrol
 import util
 
+try:
+    import numpy
+except ImportError:  # numpy is optional, only batched (vectorized) evaluators need it
+    numpy = None
 
-class ParatroopersGameState(object):
-    """ ParatrooperGameState class """
-    # TODO: link of paratroopergame class / object (so K and map and dirN can be
-    # referenced directly)
-    gameInstance = None  # reference to ParatroopersGame object (paratroopers game params etc.)
+
+class ParatroopersBoardTables(object):
+    """ Precomputed lookup tables that depend only on the board size K (shared by all games with the same K) """
 
     def __init__(self, K):
+        self.K = K
+        self.neighbourMask = [self._buildNeighbourMask(raw_index) for raw_index in xrange(K ** 2)]  # bitmask of 4-neighbours of each cell
+        self.neighbours = [[i for i in xrange(K ** 2) if mask & (1 << i)] for mask in self.neighbourMask]  # the same as lists of indexes
+        # Zobrist keys, seeded by K so that every process derives the same keys for the same board size
+        # 63 bits keep the position key a native int (no long arithmetic in the hot path)
+        rng = random.Random(K)
+        self.zobrist = [[]] + [[rng.getrandbits(63) for _ in xrange(K ** 2)] for _ in xrange(2)]  # zobrist[player][raw_index], padding 0 - indexing from 1
+        self.zobristSide = rng.getrandbits(63)  # xor-ed in when PLAYER2 is to move
+        self._neighbourIndexArray = None  # numpy version of neighbourMask, built on first use
+        self.squareSymmetries = self._buildSquareSymmetries()  # the 8 symmetries of the square as cell permutations, identity first
+
+    def _buildSquareSymmetries(self):
+        K = self.K
+        images = [lambda r, c: (r, c), lambda r, c: (c, K - 1 - r), lambda r, c: (K - 1 - r, K - 1 - c), lambda r, c: (K - 1 - c, r),
+                  lambda r, c: (r, K - 1 - c), lambda r, c: (K - 1 - r, c), lambda r, c: (c, r), lambda r, c: (K - 1 - c, K - 1 - r)]
+        permutations = []
+        for image in images:
+            permutation = []
+            for raw_index in xrange(K ** 2):
+                row, column = image(raw_index // K, raw_index % K)
+                permutation.append(row * K + column)
+            permutations.append(permutation)
+        return permutations
+
+    def neighbourIndexArray(self):
+        """ Returns (K^2, 4) numpy array of neighbour indexes, missing neighbours point at the sentinel cell K^2 """
+        if self._neighbourIndexArray is None:
+            K2 = self.K ** 2
+            self._neighbourIndexArray = numpy.array([row + [K2] * (4 - len(row)) for row in self.neighbours], dtype=numpy.intp)
+        return self._neighbourIndexArray
+
+    def _buildNeighbourMask(self, raw_index):
+        K = self.K
+        mask = 0
+        if raw_index % K != 0:
+            mask |= 1 << (raw_index - 1)
+        if raw_index % K != K - 1:
+            mask |= 1 << (raw_index + 1)
+        if raw_index <= (K ** 2 - 1 - K):
+            mask |= 1 << (raw_index + K)
+        if raw_index >= K:
+            mask |= 1 << (raw_index - K)
+        return mask
+
+
+_boardTablesCache = {}  # K -> ParatroopersBoardTables
+
+
+def getBoardTables(K):
+    """ Returns (building once) lookup tables for board of size K """
+    tables = _boardTablesCache.get(K)
+    if tables is None:
+        tables = _boardTablesCache[K] = ParatroopersBoardTables(K)
+    return tables
+
+
+class ParatroopersGameState(object):
+    """ ParatrooperGameState class, slotted (fixed set of small fields) so that clone() is cheap """
+    __slots__ = ('game', 'playerMask', 'currentPlayer', 'rewardPlayer', 'key', 'symKeys')
+
+    def __init__(self, game):
+        """ game: the ParatroopersGame (board size, map, precomputed tables), shared by all states of the game and never modified by them """
+        self.game = game
         self.playerMask = [0, 0, 0]
         self.currentPlayer = ParatroopersGame.PLAYER1
         self.rewardPlayer = [0, 0, 0]
+        self.key = 0  # Zobrist key of the position (including side to move), maintained incrementally
+        symmetryZobrist = self.game.symmetryZobrist
+        # keys of the images under the map symmetries, without the side to move (None - asymmetric map), see transpositionKey
+        self.symKeys = [0] * len(symmetryZobrist) if symmetryZobrist else None
         # self.occupiedValue = [0, 0] <-- worth introducing?
 
+    def clone(self):
+        """ Returns an independent copy of the state in O(1) (use instead of copy.deepcopy) """
+        newState = ParatroopersGameState.__new__(ParatroopersGameState)
+        newState.game = self.game
+        newState.playerMask = self.playerMask[:]
+        newState.currentPlayer = self.currentPlayer
+        newState.rewardPlayer = self.rewardPlayer[:]
+        newState.key = self.key
+        newState.symKeys = self.symKeys[:] if self.symKeys is not None else None
+        return newState
+
+    def __getstate__(self):
+        """ Pickling support (slotted class), the game descriptor travels with the state so worker processes see the right board """
+        return (self.playerMask, self.currentPlayer, self.rewardPlayer, self.key, self.symKeys, self.game)
+
+    def __setstate__(self, pickled):
+        self.playerMask, self.currentPlayer, self.rewardPlayer, self.key, self.symKeys, self.game = pickled
+
     def _getDirN(self, raw_index):
         """ Returns available moves from a given position (better way : map with borders) """
         dirN = []
-        K = ParatroopersGameState.gameInstance.K
+        K = self.game.K
         if raw_index % K != 0:
             dirN.append(-1)
         if raw_index % K != K - 1:
@@ -39,13 +127,13 @@ class ParatroopersGameState(object):
         return dirN
 
     def _inside(self, row, column):
-        return row >= 0 and row <= (ParatroopersGameState.gameInstance.K - 1) and column >= 0 and column <= (ParatroopersGameState.gameInstance.K - 1)
+        return row >= 0 and row <= (self.game.K - 1) and column >= 0 and column <= (self.game.K - 1)
 
     def _insideRaw(self, raw_index):
-        return raw_index >= 0 and raw_index <= (ParatroopersGameState.gameInstance.K ** 2 - 1)
+        return raw_index >= 0 and raw_index <= (self.game.K ** 2 - 1)
 
     def _getRawIndex(self, row, column):
-        return row * ParatroopersGameState.gameInstance.K + column
+        return row * self.game.K + column
 
     def _checkOccupancy(self, raw_index):
         """ Private function for bitmap handling, returns state of a cell """
@@ -64,9 +152,28 @@ class ParatroopersGameState(object):
         return [raw_index + d for d in self._getDirN(raw_index) if self._checkOccupancy(raw_index + d) == ParatroopersGame.FREECELL]
 
     def _takeCell(self, raw_index, player):
+        zobrist = self.game.tables.zobrist
+        enemy = self._getRevPlayer(player)
+        if self.playerMask[enemy] & (1 << raw_index):
+            self.key ^= zobrist[enemy][raw_index]
+            if self.symKeys is not None: self._toggleSymKeys(raw_index, enemy)
+        if not self.playerMask[player] & (1 << raw_index):
+            self.key ^= zobrist[player][raw_index]
+            if self.symKeys is not None: self._toggleSymKeys(raw_index, player)
         self.playerMask[player] |= (1 << raw_index)
-        self.playerMask[self._getRevPlayer(player)] &= ~(1 << raw_index)
-        self.rewardPlayer[player] += ParatroopersGameState.gameInstance.map[raw_index]
+        self.playerMask[enemy] &= ~(1 << raw_index)
+        self.rewardPlayer[player] += self.game.map[raw_index]
+
+    def _toggleSymKeys(self, raw_index, player):
+        """ Incremental update of the symmetric images' keys (symmetric maps only) """
+        for i, zobrist in enumerate(self.game.symmetryZobrist):
+            self.symKeys[i] ^= zobrist[player][raw_index]
+
+    def transpositionKey(self):
+        """ Key for transposition statistics: the minimal key among the images under the map symmetries (canonical position) """
+        if self.symKeys is None: return self.key
+        side = self.game.tables.zobristSide if self.currentPlayer == ParatroopersGame.PLAYER2 else 0  # kept out of symKeys, moves don't touch them
+        return min(self.key, min([key ^ side for key in self.symKeys]))
 
     def _getRevPlayer(self, player):
         if player == ParatroopersGame.PLAYER1:
@@ -76,10 +183,11 @@ class ParatroopersGameState(object):
 
     def _switchCurrentPlayer(self):
         self.currentPlayer = self._getRevPlayer(self.currentPlayer)
+        self.key ^= self.game.tables.zobristSide
 
     def _getPlayerCells(self, player):
         """ Returns list of occupied cells """
-        return [i for i in xrange(0, ParatroopersGameState.gameInstance.K ** 2) if self.playerMask[player] & (1 << i)]
+        return [i for i in xrange(0, self.game.K ** 2) if self.playerMask[player] & (1 << i)]
 
     def addToReward(self, player, reward):
         self.rewardPlayer[player] += reward
@@ -88,47 +196,71 @@ class ParatroopersGameState(object):
         """
         Return a list of legal actions (row*K + column). Legal action means that we can put there our paratrooper (or by paczkowanie or by deploying:)
         Simplification : no S moves (because always beneficial to capture enemy's troops
+        Actions are plain integers (raw cell indexes), see actionToString / actionFromString for the human readable form
         """
-        # TODO: can be done in one-liner
-        # raw_indexes = list(set(util.flatten([self._getFreeNeighbours(raw_index) for raw_index in self._getPlayerCells(self.currentPlayer)])))
-        return ['D' + str(i) for i in xrange(0, ParatroopersGameState.gameInstance.K ** 2) if self._checkOccupancy(i) == ParatroopersGame.FREECELL]  # + ['S' + str(i) for i in raw_indexes]
+        occupied = self.playerMask[ParatroopersGame.PLAYER1] | self.playerMask[ParatroopersGame.PLAYER2]
+        return [i for i in xrange(0, self.game.K ** 2) if not occupied & (1 << i)]
 
     def isTerminal(self):
-        return sum(self.rewardPlayer) == ParatroopersGameState.gameInstance.mapsum
+        return sum(self.rewardPlayer) == self.game.mapsum
+
+    def getGain(self, action):
+        """ Immediate reward gain of the player to move from action: value of the cell plus values of the enemy cells it captures """
+        game = self.game
+        gain = game.map[action]
+        neighbours = game.tables.neighbourMask[action]
+        if self.playerMask[self.currentPlayer] & neighbours:
+            captured = self.playerMask[self._getRevPlayer(self.currentPlayer)] & neighbours
+            while captured:
+                cell = captured & -captured
+                gain += game.map[cell.bit_length() - 1]
+                captured ^= cell
+        return gain
 
     def result(self, action, copyState=True):
-        """ Executes action and returns new state """
-        raw_index = int(action[1:])
+        """ Executes action (raw cell index) and returns new state """
+        raw_index = action
 
-        newState = copy.deepcopy(self) if copyState == True else self
-        newState._takeCell(raw_index, newState.currentPlayer)
+        newState = self.clone() if copyState == True else self
+        player = newState.currentPlayer
+        enemy = newState._getRevPlayer(player)
+        newState._takeCell(raw_index, player)
 
         ### SIMPLIFICATION ###
         #         if action[0:1] == 'S':
-        neigh_troop = False
-        for d in newState._getDirN(raw_index):
-            if newState._checkOccupancy(raw_index + d) == newState.currentPlayer:
-                neigh_troop = True
-                break
-        if neigh_troop == True:
-            for d in newState._getDirN(raw_index):
-                if newState._checkOccupancy(raw_index + d) == newState._getRevPlayer(newState.currentPlayer):
-                    newState._takeCell(raw_index + d, newState.currentPlayer)
-                    newState.rewardPlayer[newState._getRevPlayer(newState.currentPlayer)] -= ParatroopersGameState.gameInstance.map[raw_index + d]
+        neighbours = self.game.tables.neighbourMask[raw_index]
+        if newState.playerMask[player] & neighbours:  # own troop adjacent - capture all enemy neighbours
+            captured = newState.playerMask[enemy] & neighbours
+            if captured:
+                newState.playerMask[player] |= captured
+                newState.playerMask[enemy] &= ~captured
+                gameMap = self.game.map
+                zobrist = self.game.tables.zobrist
+                while captured:
+                    cell = captured & -captured
+                    index = cell.bit_length() - 1
+                    value = gameMap[index]
+                    newState.rewardPlayer[player] += value
+                    newState.rewardPlayer[enemy] -= value
+                    newState.key ^= zobrist[player][index] ^ zobrist[enemy][index]
+                    if newState.symKeys is not None:
+                        newState._toggleSymKeys(index, player)
+                        newState._toggleSymKeys(index, enemy)
+                    captured ^= cell
         newState._switchCurrentPlayer()
         return newState
 
     #### Specjalne metody dla pythona, np zeby dzialal slownik ###
     def __hash__(self):
-        return hash(self.playerMask[ParatroopersGame.PLAYER1] + self.playerMask[ParatroopersGame.PLAYER2] << (ParatroopersGameState.gameInstance.K ** 2 - 1))  # mozna poprawic zeby dzialalo szybciej
+        return self.key
 
     def __to_string(self):
         lines = []
-        horizLine = '-' * 6 * ParatroopersGameState.gameInstance.K
+        horizLine = '-' * 6 * self.game.K
         lines.append(horizLine)
-        for row in xrange(ParatroopersGameState.gameInstance.K):
+        for row in xrange(self.game.K):
             rowStr = '| '
-            for column in xrange(ParatroopersGameState.gameInstance.K):
+            for column in xrange(self.game.K):
                 rowStr += '{0:2d}'.format(self._checkOccupancy(self._getRawIndex(row, column))) + '  | '
             lines.append(rowStr)
             lines.append(horizLine)
@@ -138,15 +270,18 @@ class ParatroopersGameState(object):
         return self.__to_string()
 
     def __eq__(self, other):
-        if self.playerMask[ParatroopersGame.PLAYER1] == other.playerMask[ParatroopersGame.PLAYER1] and self.playerMask[ParatroopersGame.PLAYER2] == other.playerMask[ParatroopersGame.PLAYER2]:
-            return True
-        else:
-            return False
+        """ Keys are compared first (cheap, almost always decisive), masks guard against Zobrist collisions """
+        return self.key == other.key and self.currentPlayer == other.currentPlayer and self.playerMask == other.playerMask
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
     def printPygame(self, screen):
+        import pygame  # imported lazily, only rendering needs it
+
         color_by_occ = {0: (30, 30, 30), 1: (220, 0, 0), 2: (0, 220, 0)}
-        for row in xrange(ParatroopersGameState.gameInstance.K):
-            for column in xrange(ParatroopersGameState.gameInstance.K):
+        for row in xrange(self.game.K):
+            for column in xrange(self.game.K):
                 occ = self._checkOccupancy(self._getRawIndex(row, column))
                 color = color_by_occ[occ]
 
@@ -169,12 +304,40 @@ class ParatroopersGame(object):
         self.K = K
         self.map = copy.deepcopy(M)  # Internally map is represented as 1D list (matrix row by row)!
         self.mapsum = sum(M)
-        ParatroopersGameState.gameInstance = self  # States references one distinct "game descriptor", so in fact ParatroopersGame is a singleton class
-        self.gameState = ParatroopersGameState(K)
+        self.tables = getBoardTables(K)  # shared neighbour tables for this board size
+        self._detectSymmetries()
+        self.gameState = ParatroopersGameState(self)  # states reference the game, so any number of games can live side by side
         self.options = {"startupTime": 1, "getActionTime": 10}  # Time constraints
 
+    def _detectSymmetries(self):
+        """
+            Finds the symmetries of the square that map the board values onto themselves (automorphisms of the map)
+            symmetries - their cell permutations (identity first), symmetryZobrist - Zobrist tables permuted by each non-identity one
+        """
+        self.symmetries = [permutation for permutation in self.tables.squareSymmetries if all(self.map[permutation[i]] == self.map[i] for i in xrange(self.K ** 2))]
+        zobrist = self.tables.zobrist
+        self.symmetryZobrist = [[[]] + [[zobrist[player][permutation[i]] for i in xrange(self.K ** 2)] for player in (ParatroopersGame.PLAYER1, ParatroopersGame.PLAYER2)]
+                                for permutation in self.symmetries[1:]]
+
+    def getFingerprint(self):
+        """ 63 bit fingerprint of the board (size and cell values), identifies the map in persistent transposition stores """
+        digest = hashlib.md5(' '.join(str(value) for value in [self.K] + self.map)).hexdigest()
+        return int(digest[:16], 16) >> 1
+
+    def __getstate__(self):
+        """ Pickling support: the shared tables are rebuilt from the per-K cache, the current state is not needed """
+        pickled = self.__dict__.copy()
+        del pickled["tables"], pickled["gameState"], pickled["symmetries"], pickled["symmetryZobrist"]
+        return pickled
+
+    def __setstate__(self, pickled):
+        self.__dict__.update(pickled)
+        self.tables = getBoardTables(self.K)
+        self._detectSymmetries()
+        self.gameState = ParatroopersGameState(self)
+
     def resetGame(self):
-        self.gameState = ParatroopersGameState(self.K)
+        self.gameState = ParatroopersGameState(self)
         print self.gameState
 
     def printBoard(self):
@@ -200,7 +363,7 @@ class RandomAgent(Agent):
         self.player = player
         pass
 
-    def getAction(self, state):
+    def getAction(self, state, deadline=None):
         return random.choice(state.getLegalActions())
 
 
@@ -211,7 +374,7 @@ class GreedyAgent(Agent):
         self.heuristic = heuristic
         self.player = player
 
-    def getAction(self, state):
+    def getAction(self, state, deadline=None):
         actions = state.getLegalActions()  # get legal actions
         l = [self.heuristic(state.result(action), self.player) for action in actions]
         return actions[l.index(max(l))]  # return best action according to the heuristic
@@ -227,10 +390,10 @@ class KeyboardParatroopersAgent(Agent):
     def __init__(self, game):
         self.game = game
 
-    def getAction(self, state):
+    def getAction(self, state, deadline=None):
         print "Current board : \n"
         self.game.printBoard()
-        return util.input_string()
+        return actionFromString(util.input_string())
 
     def initState(self, state):
         """ Register initial state """
@@ -240,72 +403,101 @@ class KeyboardParatroopersAgent(Agent):
 class GameSimulator(object):
     """ Class for handling game """
 
-    def __init__(self, game, agents, timePerMove=1, printEachMove=True, printActions=True, printSummary=True):
+    def __init__(self, game, agents, timePerMove=1, printEachMove=True, printActions=True, printSummary=True, render=True, timeControl=None):
         """
            timePerMove : time per move in [s]
+           render : draw the board in a pygame window after each move (pygame is imported only if set), setSilent() turns it off
+           timeControl : (total, increment) in [s] - each agent plays on its own timecontrol.PlayerClock and gets the move Deadline in getAction,
+                         an agent overstepping its clock (or the startup time) loses the game: playGame stops and returns the rewards
+                         reached so far, the index of that agent is left in flagged; None - no time limit
             Assumption: the game is started by the first agent in the list, so the gameState passed to getAction() has got correct currentPlayer
         """
         self.agents = agents
         self.current_agent = 0
         self.game = game
         self.agentTotalTime = [0, 0]  # measure time consumption
-        self.options = {"printEachMove": printEachMove, "printSummary": printSummary, "printActions": printActions, 'timeoutStartup': 1, 'timeoutGetAction': 200000000}  # no timeout
-        self.game.options["getActionTime"] = 20000000
+        self.options = {"printEachMove": printEachMove, "printSummary": printSummary, "printActions": printActions, "render": render}
+        self.clocks = [timecontrol.PlayerClock(*timeControl) for _ in agents] if timeControl is not None else None
+        self.flagged = None  # index of the agent that lost the last game on time, None - game played out
 
     def setSilent(self):
-        self.options["printEachMove"] = self.options["printActions"] = self.options["printSummary"] = False
+        self.options["printEachMove"] = self.options["printActions"] = self.options["printSummary"] = self.options["render"] = False
 
-    def playGame(self):
+    def _initDisplay(self):
+        """ Opens the pygame window, returns the screen """
+        import pygame  # imported lazily, headless simulations never touch pygame
 
         pygame.init()
-
         K = self.game.K
-
         screen_size = K * square_size, K * square_size
-        screen = pygame.display.set_mode(screen_size)
-        clock = pygame.time.Clock()
+        return pygame.display.set_mode(screen_size)
+
+    def playGame(self):
+        """ Plays one game (see _runGame), agents are notified by final() however it ends """
+        try:
+            return self._runGame()
+        finally:
+            for agent in self.agents: agent.final(self.game.gameState)
+
+    def _runGame(self):
+        screen = self._initDisplay() if self.options.get("render", False) == True else None
 
         """ Executes the game """
+        self.current_agent = 0
+        self.agentTotalTime = [0, 0]
+        self.flagged = None
         ### Agent initialization ###
         for agent in xrange(len(self.agents)):
-            initAgentFunc = util.TimeoutFunction(self.agents[agent].initState, self.options["timeoutStartup"])
-            try:
-                start_time = time.time()
-                initAgentFunc(self.game.gameState)
-                elapsed_time = time.time() - start_time
-                if elapsed_time > self.game.options["startupTime"]: raise util.TimeoutFunctionException()
-                self.agentTotalTime[agent] += elapsed_time
-            except util.TimeoutFunctionException:
+            start_time = time.time()
+            self.agents[agent].initState(self.game.gameState)
+            elapsed_time = time.time() - start_time
+            self.agentTotalTime[agent] += elapsed_time
+            if elapsed_time > self.game.options["startupTime"]:
                 print 'Agent {agent} timed out on startup'.format(**locals())
-                return
+                self.flagged = agent
+                return self.game.gameState.rewardPlayer[1:3]
+        if self.clocks is not None:
+            for clock in self.clocks: clock.reset()
         ### Run game simulation ###
         moveCount = 0
         while self.game.isOver() == False:
-            action = None
-            agent_getAction = util.TimeoutFunction(self.agents[self.current_agent].getAction, self.options["timeoutGetAction"])
-            try:
+            agent = self.current_agent
+            if self.clocks is None:
                 start_time = time.time()
-                action = agent_getAction(self.game.gameState)
-                elapsed_time = time.time() - start_time
-                if elapsed_time > self.game.options["getActionTime"]: raise util.TimeoutFunctionException()
-                self.agentTotalTime[agent] += elapsed_time
-            except util.TimeoutFunctionException:
-                print 'Agent {agent} timed out on getAction call'.format(**locals())
-                return
-
-            if self.options.get("printActions", False) == True: print "Action taken : {action}".format(**locals())
+                action = self.agents[agent].getAction(self.game.gameState)
+                self.agentTotalTime[agent] += time.time() - start_time
+            else:
+                action = self.agents[agent].getAction(self.game.gameState, self.clocks[agent].startMove())
+                self.agentTotalTime[agent] += self.clocks[agent].stopMove()
+                if self.clocks[agent].flagged:
+                    print 'Agent {agent} ran out of time on getAction call'.format(**locals())
+                    self.flagged = agent
+                    return self.game.gameState.rewardPlayer[1:3]
+
+            if self.options.get("printActions", False) == True: print "Action taken : {0}".format(actionToString(action))
 
             self.game.gameState = self.game.gameState.result(action)
             moveCount += 1
             if self.options.get("printEachMove", False) == True:
                 print "After move {moveCount} by {self.current_agent}".format(**locals())
                 print "Rewards {lista}".format(lista=self.game.gameState.rewardPlayer[1:3])
+            if screen is not None:
                 self.game.gameState.printPygame(screen)
             self.current_agent = (self.current_agent + 1) % (len(self.agents))
         if self.options.get("printSummary", False) == True:  print 'Total time taken : {self.agentTotalTime}'.format(**locals())
         return self.game.gameState.rewardPlayer[1:3]
 
 
+def actionToString(action):
+    """ Human readable form of an action, e.g. 17 -> 'D17' """
+    return 'D' + str(action)
+
+
+def actionFromString(description):
+    """ Parses human readable action, e.g. 'D17' -> 17 """
+    return int(description.strip()[1:])
+
+
 def greedyHeuristic(state, player):
     return state.rewardPlayer[player]
 
@@ -316,11 +508,131 @@ def paratroopersGreedyHeuristicVector(state):
     return [0, state.rewardPlayer[ParatroopersGame.PLAYER1] / float(sum), state.rewardPlayer[ParatroopersGame.PLAYER2] / float(sum)]  # padding 0 - indexing from 1
 
 
+def paratroopersGainPrior(state, action):
+    """ Prior of action for UCTAgent priorFunction: its immediate gain as a share of the map (the scale of paratroopersGreedyHeuristicVector) """
+    return state.getGain(action) / float(state.game.mapsum)
+
+
+def paratroopersBatchRolloutVector(state, count=256):
+    """
+        Plays count uniformly random playouts from state at once (vectorized with numpy)
+        Returns the mean of paratroopersGreedyHeuristicVector over all playouts
+        To change count pass e.g. functools.partial(paratroopersBatchRolloutVector, count=1024) as UCTAgent rolloutFunction
+    """
+    if numpy is None: raise ImportError("paratroopersBatchRolloutVector requires numpy")
+    game = state.game
+    K2 = game.K ** 2
+    neighbours = game.tables.neighbourIndexArray()
+    values = numpy.array(game.map + [0], dtype=numpy.float64)
+
+    board = numpy.zeros((count, K2 + 1), dtype=numpy.int8)  # cell owners for each playout, last column is the sentinel (outside) cell
+    board[:, K2] = ParatroopersGame.OUTSIDECELL
+    for player in (ParatroopersGame.PLAYER1, ParatroopersGame.PLAYER2):
+        board[:, state._getPlayerCells(player)] = player
+
+    rows = numpy.arange(count)[:, None]
+    player, enemy = state.currentPlayer, state._getRevPlayer(state.currentPlayer)
+    for _ in xrange(len(state.getLegalActions())):  # every move fills exactly one cell, so all playouts end together
+        keys = numpy.random.random_sample(board.shape)
+        keys[board != ParatroopersGame.FREECELL] = -1.0
+        cells = keys.argmax(axis=1)  # uniformly random free cell in each playout
+        board[rows[:, 0], cells] = player
+        neighbourCells = neighbours[cells]
+        owners = board[rows, neighbourCells]
+        captured = (owners == enemy) & (owners == player).any(axis=1)[:, None]
+        board[rows, neighbourCells] = numpy.where(captured, player, owners)
+        player, enemy = enemy, player
+
+    reward1 = (board == ParatroopersGame.PLAYER1).dot(values)
+    reward2 = (board == ParatroopersGame.PLAYER2).dot(values)
+    total = reward1 + reward2
+    return [0, float((reward1 / total).mean()), float((reward2 / total).mean())]  # padding 0 - indexing from 1
+
+
+def _heavyWeight(cell, player, owner, gameMap, neighbours, bias):
+    """ Weight of free cell for player in the heavy playout: (cell value plus values of the enemy cells it would capture) ** bias """
+    gain, captured, adjacent = gameMap[cell], 0, False
+    for neighbour in neighbours[cell]:
+        occupant = owner[neighbour]
+        if occupant == player:
+            adjacent = True
+        elif occupant != ParatroopersGame.FREECELL:
+            captured += gameMap[neighbour]
+    if adjacent: gain += captured
+    return gain if bias == 1.0 else gain ** bias
+
+
+def paratroopersHeavyRolloutVector(state, bias=0.5, played=None):
+    """
+        "Heavy" playout: every move is sampled with probability proportional to its weight (see _heavyWeight), bias 0 - uniformly random
+        (greedier playouts, bias 1 and more, made UCT weaker in test games - both sides then play too predictably)
+        Weights of both players are kept for every free cell, a move updates only the free cells next to the cells it changed
+        Returns paratroopersGreedyHeuristicVector of the final position, played - if given, played[player] collects bits of the cells player took
+        (as UCTAgent.rollout does, so the playout feeds RAVE statistics - see recordsPlayed below)
+        To change bias pass e.g. functools.partial(paratroopersHeavyRolloutVector, bias=2.0) as UCTAgent rolloutFunction
+        (set recordsPlayed = True on the partial too, for RAVE)
+    """
+    game = state.game
+    gameMap, neighbours = game.map, game.tables.neighbours
+    K2 = game.K ** 2
+    owner = [ParatroopersGame.FREECELL] * K2
+    for player in (ParatroopersGame.PLAYER1, ParatroopersGame.PLAYER2):
+        for cell in state._getPlayerCells(player): owner[cell] = player
+    free = [cell for cell in xrange(K2) if owner[cell] == ParatroopersGame.FREECELL]
+    position = [0] * K2  # index of a free cell in free
+    for i, cell in enumerate(free): position[cell] = i
+    weight, total = [None, [0.0] * K2, [0.0] * K2], [0, 0.0, 0.0]  # padding 0 - indexing from 1
+    for player in (ParatroopersGame.PLAYER1, ParatroopersGame.PLAYER2):
+        for cell in free:
+            weight[player][cell] = _heavyWeight(cell, player, owner, gameMap, neighbours, bias)
+        total[player] = sum(weight[player][cell] for cell in free)
+
+    reward = state.rewardPlayer[:]
+    player, enemy = state.currentPlayer, state._getRevPlayer(state.currentPlayer)
+    while free:
+        playerWeight = weight[player]
+        r = random.random() * total[player]
+        for cell in free:
+            r -= playerWeight[cell]
+            if r < 0: break
+        if played is not None: played[player] |= 1 << cell
+        last = free.pop()  # remove cell (swap with the last free cell)
+        if last != cell:
+            free[position[cell]] = last
+            position[last] = position[cell]
+        total[player] -= playerWeight[cell]
+        total[enemy] -= weight[enemy][cell]
+
+        owner[cell] = player
+        reward[player] += gameMap[cell]
+        changed = [cell]
+        if any(owner[neighbour] == player for neighbour in neighbours[cell]):  # own troop adjacent - capture all enemy neighbours
+            for neighbour in neighbours[cell]:
+                if owner[neighbour] == enemy:
+                    owner[neighbour] = player
+                    reward[player] += gameMap[neighbour]
+                    reward[enemy] -= gameMap[neighbour]
+                    changed.append(neighbour)
+        for changedCell in changed:
+            for neighbour in neighbours[changedCell]:
+                if owner[neighbour] != ParatroopersGame.FREECELL: continue
+                for p in (ParatroopersGame.PLAYER1, ParatroopersGame.PLAYER2):
+                    updated = _heavyWeight(neighbour, p, owner, gameMap, neighbours, bias)
+                    total[p] += updated - weight[p][neighbour]
+                    weight[p][neighbour] = updated
+        player, enemy = enemy, player
+
+    rewardSum = float(reward[ParatroopersGame.PLAYER1] + reward[ParatroopersGame.PLAYER2])
+    return [0, reward[ParatroopersGame.PLAYER1] / rewardSum, reward[ParatroopersGame.PLAYER2] / rewardSum]  # padding 0 - indexing from 1
+
+
+paratroopersHeavyRolloutVector.recordsPlayed = True  # UCTAgent in RAVE mode passes it played
+
+
 def paratroopersRandomSetHeuristicVector(state):
     """ Returns reward for player 1 and 2, after having filled the rest of the board randomly """
-    state_cpy = copy.deepcopy(state)
-    ParatroopersGameState._takeCell
-    for d in xrange(ParatroopersGameState.gameInstance.K ** 2):
+    state_cpy = state.clone()
+    for d in xrange(state.game.K ** 2):
         if (state_cpy._checkOccupancy(d) == ParatroopersGame.FREECELL):
             state_cpy._takeCell(d, random.choice([ParatroopersGame.PLAYER1, ParatroopersGame.PLAYER2]))
 
@@ -328,6 +640,27 @@ def paratroopersRandomSetHeuristicVector(state):
     return [0, state_cpy.rewardPlayer[ParatroopersGame.PLAYER1] / float(sum), state_cpy.rewardPlayer[ParatroopersGame.PLAYER2] / float(sum)]  # padding 0 - indexing from 1
 
 
+def paratroopersRandomFillVector(state, count=64):
+    """
+        Batched paratroopersRandomSetHeuristicVector: fills the free cells at random (every cell goes to either player, no captures)
+        count times at once and returns the mean reward split. count None - the exact expectation (the split is linear in the fill)
+        Vectorized with numpy if available, to change count pass e.g. functools.partial(paratroopersRandomFillVector, count=256) as UCTAgent cutFunction
+    """
+    game = state.game
+    occupied = state.playerMask[ParatroopersGame.PLAYER1] | state.playerMask[ParatroopersGame.PLAYER2]
+    freeValues = [game.map[i] for i in xrange(game.K ** 2) if not occupied & (1 << i)]
+    total = float(game.mapsum)
+    if count is None:
+        fill1 = sum(freeValues) / 2.0
+    elif numpy is not None:
+        owners = numpy.random.randint(2, size=(count, len(freeValues)))  # 1 - the cell goes to player 1
+        fill1 = float(owners.dot(numpy.array(freeValues, dtype=numpy.float64)).mean())
+    else:
+        fill1 = sum(value for _ in xrange(count) for value in freeValues if random.getrandbits(1)) / float(count)
+    reward1 = state.rewardPlayer[ParatroopersGame.PLAYER1] + fill1
+    return [0, reward1 / total, (total - reward1) / total]  # padding 0 - indexing from 1
+
+
 def testMapRepresentation():
     print "hello"
     testGame = ParatroopersGame(3, [1, 2, 3, 4, 5, 6, 7, 8, 9])
@@ -340,14 +673,14 @@ def testMoves():
     testGame = ParatroopersGame(3, [1, 2, 3, 4, 5, 6, 7, 8, 9])
     gs = testGame.gameState
     print str(gs.playerMask[1])
-    gs_mod = gs.result('D3').result('D4').result('D5').result('D6').result('D0').result('D7')
+    gs_mod = gs.result(3).result(4).result(5).result(6).result(0).result(7)
     print gs_mod.getLegalActions()
-    gs_mod = gs_mod.result('S1')
+    gs_mod = gs_mod.result(1)
     print str(gs_mod)
     print "Reward = " + str(gs_mod.rewardPlayer[1])
     print locals()
-    gs_mod = gs_mod.result('D2')
-    gs_mod = gs_mod.result('D8')
+    gs_mod = gs_mod.result(2)
+    gs_mod = gs_mod.result(8)
     print str(gs_mod)
     print gs_mod.getLegalActions()
 
@@ -1,10 +1,15 @@
 """
 Game Logic for Paratroopers
 """
+import json
 from optparse import OptionParser
 
 import UCT
+import alphabeta
 import paratroopers
+import timecontrol
+import tournament
+import transposition
 from paratroopers import ParatroopersGame, RandomAgent, GreedyAgent, GameSimulator, randomBoard
 
 
@@ -22,31 +27,37 @@ def testGameSim():
 
 def rankTwoAgents(testGame, gameSimulator, agent1, agent2, sim_count=10):
     agents_scores = ([], [])
+    flagged = []  # per game: index of the agent that lost on time, or None
     for _ in xrange(sim_count):
         testGame.resetGame()
         agent1_score, agent2_score = gameSimulator.playGame()
 
         agents_scores[0].append(agent1_score)
         agents_scores[1].append(agent2_score)
+        flagged.append(gameSimulator.flagged)
         print (agent1_score, agent2_score)
 
     print "Simulation has ended"
-    _print_stats(agents_scores)
+    _print_stats(agents_scores, flagged)
 
 
-def _print_stats(agents_scores):
-    _print_games_won_count(agents_scores)
+def _print_stats(agents_scores, flagged):
+    _print_games_won_count(agents_scores, flagged)
     _print_total_scores(agents_scores)
     _print_scores(agents_scores)
 
 
-def _print_games_won_count(agents_scores):
+def _print_games_won_count(agents_scores, flagged):
     won_by_1_count = 0
     won_by_2_count = 0
     draws = 0
 
-    for agent1_score, agent2_score in zip(*agents_scores):
-        if agent1_score > agent2_score:
+    for (agent1_score, agent2_score), flag in zip(zip(*agents_scores), flagged):
+        if flag == 0:
+            won_by_2_count += 1
+        elif flag == 1:
+            won_by_1_count += 1
+        elif agent1_score > agent2_score:
             won_by_1_count += 1
         elif agent1_score < agent2_score:
             won_by_2_count += 1
@@ -78,25 +89,48 @@ def create_parser():
     parser = OptionParser()
     parser.add_option("-r", "--random_board", default=1, type="int", dest="rand_board", help="If set to 0  expects only board size (K), else (K) and row-wise map cells")
     parser.add_option("-v", "--verbose", default=True, type="int", dest="verbose", help="If set prints simulation steps")
-    parser.add_option("--agent_1", type="string", default="UCTAgent", dest="agent1", help="""Set agent1 to "UCTAgent","UCTAgentTran", "UCTAgentTranCut", "RandomAgent", "GreedyAgent" """)
-    parser.add_option("--agent_2", type="string", default="GreedyAgent", dest="agent2", help="""Set agent2 to "UCTAgent", "UCTAgentTran", "UCTAgentTranCut",  "RandomAgent", "GreedyAgent" """)
-    parser.add_option("-t", "--time_per_move", default=3, type="int", dest="time_per_move", help="Set time per move, default is 2s")
+    parser.add_option("--agent_1", type="string", default="UCTAgent", dest="agent1", help="""Set agent1 to "UCTAgent","UCTAgentTran", "UCTAgentTranCut", "UCTAgentBatch", "UCTArrayAgent", "UCTAgentSolver", "UCTAgentRAVE", "UCTAgentPrior", "UCTAgentHeavy", "AlphaBetaAgent", "RandomAgent", "GreedyAgent" """)
+    parser.add_option("--agent_2", type="string", default="GreedyAgent", dest="agent2", help="""Set agent2 to "UCTAgent", "UCTAgentTran", "UCTAgentTranCut", "UCTAgentBatch", "UCTArrayAgent", "UCTAgentSolver", "UCTAgentRAVE", "UCTAgentPrior", "UCTAgentHeavy", "AlphaBetaAgent", "RandomAgent", "GreedyAgent" """)
+    parser.add_option("-t", "--time_per_move", default=3, type="float", dest="time_per_move", help="Set time per move of the searching agents, default is 3s")
     parser.add_option("-n", "--number_of_simulations", default=10, type="int", dest="num_sim", help="Sets number of simulations, default is 10")
+    parser.add_option("-m", "--mode", type="string", default="simulation", dest="mode",
+                      help=""""simulation" - games played one by one, "tournament" - games spread over a process pool, results printed as JSON lines""")
+    parser.add_option("-w", "--workers", default=0, type="int", dest="workers", help="Tournament mode: number of worker processes, default is number of cores")
+    parser.add_option("-s", "--seed", default=None, type="int", dest="seed", help="Tournament mode: seed of the per-game seeds")
+    parser.add_option("--time_control", type="string", default=None, dest="time_control",
+                      help="""Clock of each agent as "total+increment" in seconds (e.g. "60+0.5"), agents then budget their moves from the clock""")
+    parser.add_option("--transposition_file", type="string", default=None, dest="transposition_file", help="Persistent transposition store shared by the UCTAgentTran* agents")
     return parser
 
 
-def create_agent(description, player, time):
-    """ Aux function for creating agents """
+def create_agent(description, player, time, transpositionStore=None):
+    """ Aux function for creating agents, time - time per move of the searching agents in [s] """
     if description == "UCTAgent":
-        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, transpositions=False)
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=False)
     if description == "GreedyAgent":
         return GreedyAgent(paratroopers.greedyHeuristic, player)
     if description == "RandomAgent":
         return RandomAgent(player)
     if description == "UCTAgentTran":
-        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, transpositions=True)
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=True, transpositionStore=transpositionStore)
     if description == "UCTAgentTranCut":
-        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, transpositions=True, cutLevel=0, cutFunction=paratroopers.paratroopersRandomSetHeuristicVector)
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=True, cutLevel=0, cutFunction=paratroopers.paratroopersRandomFillVector,
+                            transpositionStore=transpositionStore)
+    if description == "UCTArrayAgent":
+        return UCT.UCTArrayAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time)
+    if description == "UCTAgentBatch":
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=True, rolloutFunction=paratroopers.paratroopersBatchRolloutVector)
+    if description == "UCTAgentRAVE":
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, bestChildPolicy=UCT.UCTAgent.RAVEPolicy, transpositions=False)
+    if description == "UCTAgentPrior":
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=False, priorFunction=paratroopers.paratroopersGainPrior,
+                            widening=(2.0, 0.5), progressiveBias=1.0)
+    if description == "UCTAgentHeavy":
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=False, rolloutFunction=paratroopers.paratroopersHeavyRolloutVector)
+    if description == "AlphaBetaAgent":
+        return alphabeta.AlphaBetaAgent(paratroopers.greedyHeuristic, player, time)
+    if description == "UCTAgentSolver":
+        return UCT.UCTAgent(paratroopers.paratroopersGreedyHeuristicVector, player, time, transpositions=True, transpositionStore=transpositionStore, solverThreshold=10)
     else:
         raise NotImplementedError("Not implemented agent!")
 
@@ -114,16 +148,26 @@ def main():
     else:
         board = randomBoard(K)
 
+    timeControl = timecontrol.parseTimeControl(options.time_control) if options.time_control is not None else None
+    if options.mode == "tournament":
+        stats = tournament.runTournament(create_agent, (options.agent1, options.agent2), K, board, options.num_sim, options.workers or None, options.time_per_move,
+                                         options.seed, timeControl=timeControl)
+        print json.dumps({"summary": stats.summary()})
+        return
+
     testGame = ParatroopersGame(K, board)
     print "Board:"
     testGame.printBoard()
 
     ### CREATE AGENTS ###
-    agent1 = create_agent(options.agent1, ParatroopersGame.PLAYER1, options.time_per_move)
-    agent2 = create_agent(options.agent2, ParatroopersGame.PLAYER2, options.time_per_move)
+    store = None
+    if options.transposition_file is not None:
+        store = transposition.TranspositionStore(options.transposition_file, testGame.getFingerprint())
+    agent1 = create_agent(options.agent1, ParatroopersGame.PLAYER1, options.time_per_move, store)
+    agent2 = create_agent(options.agent2, ParatroopersGame.PLAYER2, options.time_per_move, store)
 
     ### CREATE GAME SIMULATOR ###
-    gameSimulator = GameSimulator(testGame, (agent1, agent2), 10)
+    gameSimulator = GameSimulator(testGame, (agent1, agent2), 10, timeControl=timeControl)
     if options.verbose == False: gameSimulator.setSilent()
 
     ### RUN GAME SIMULATION ###
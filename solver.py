@@ -0,0 +1,69 @@
+"""
+Exact endgame solver: negamax with alpha-beta pruning and its own transposition table
+Value of a position is the final score difference (player to move minus the opponent) under perfect play of both sides
+Used by UCTAgent (solverThreshold) once only a few free cells are left
+"""
+
+EXACT, LOWER, UPPER = 0, 1, 2  # kind of the value stored in the table
+INFINITY = float('inf')
+
+
+def orderedChildren(state, firstAction=None):
+    """ Children (state, action) - firstAction (e.g. from a table) first, then by immediate gain of the player to move (cell value plus captures) """
+    player = state.currentPlayer
+    children = [(state.result(action), action) for action in state.getLegalActions()]
+    children.sort(key=lambda child: (child[1] != firstAction, -child[0].rewardPlayer[player]))
+    return children
+
+
+class EndgameSolver(object):
+    """
+        Transposition table maps the Zobrist key of a position to (value, kind, best action)
+        Keys don't identify the board values, so the table is valid for one game only (see clear)
+    """
+
+    def __init__(self, maxEntries=1 << 20):
+        """ maxEntries: the table is cleared when it grows beyond this size """
+        self.maxEntries = maxEntries
+        self.table = {}
+        self.nodes = 0  # positions visited since the last clear
+
+    def clear(self):
+        self.table = {}
+        self.nodes = 0
+
+    def solve(self, state):
+        """ Returns (value, best action) of state, action is None for terminal states """
+        if len(self.table) > self.maxEntries: self.table = {}
+        value = self._negamax(state, -INFINITY, INFINITY)
+        entry = self.table.get(state.key)
+        return value, entry[2] if entry is not None else None
+
+    def playOut(self, state):
+        """ Returns the terminal state reached when both players follow the solved best actions (state is not modified) """
+        while not state.isTerminal():
+            state = state.result(self.solve(state)[1])
+        return state
+
+    def _negamax(self, state, alpha, beta):
+        self.nodes += 1
+        if state.isTerminal():
+            return 2 * state.rewardPlayer[state.currentPlayer] - sum(state.rewardPlayer)
+        entry = self.table.get(state.key)
+        bestAction = None
+        if entry is not None:
+            value, kind, bestAction = entry
+            if kind == EXACT: return value
+            if kind == LOWER: alpha = max(alpha, value)
+            else: beta = min(beta, value)
+            if alpha >= beta: return value
+        originalAlpha = alpha
+        best = -INFINITY
+        for child, action in orderedChildren(state, bestAction):
+            value = -self._negamax(child, -beta, -alpha)
+            if value > best: best, bestAction = value, action
+            if best > alpha: alpha = best
+            if alpha >= beta: break
+        kind = UPPER if best <= originalAlpha else LOWER if best >= beta else EXACT
+        self.table[state.key] = (best, kind, bestAction)
+        return best
@@ -0,0 +1,69 @@
+"""
+Time control: per-player clocks (total time plus increment per move) and cooperative move deadlines
+Plain wall-clock arithmetic (no signals), so it works with sub-second precision in any thread or worker process
+"""
+import time
+
+
+class Deadline(object):
+    """
+        Cooperative deadline of one move, passed to Agent.getAction
+        The agent is expected to return before expired(), allocate() suggests how much of the clock to spend
+    """
+    SAFETY = 0.9  # fraction of the hard remaining time an allocation may use (leaves room for overhead)
+
+    def __init__(self, seconds, clock=None):
+        """ seconds: time available for this move, clock: PlayerClock the move is played on (None - standalone deadline) """
+        self.start = time.time()
+        self.end = self.start + seconds
+        self.clock = clock
+
+    def remaining(self):
+        return max(0.0, self.end - time.time())
+
+    def expired(self):
+        return time.time() >= self.end
+
+    def allocate(self, movesLeft):
+        """ Suggested thinking time: even share of the clock over our remaining moves plus the increment, never past the deadline """
+        hardLimit = self.remaining() * Deadline.SAFETY
+        if self.clock is None: return hardLimit
+        share = self.clock.remaining / max(1, movesLeft) + self.clock.increment
+        return min(share, hardLimit)
+
+
+class PlayerClock(object):
+    """ Clock of one player: total time, increment added after every move, optional hard limit per move """
+
+    def __init__(self, total, increment=0.0, moveLimit=None):
+        self.total = total
+        self.increment = increment
+        self.moveLimit = moveLimit
+        self.reset()
+
+    def reset(self):
+        self.remaining = float(self.total)
+        self.flagged = False
+        self._moveStart = None
+
+    def startMove(self):
+        """ Starts the clock, returns the Deadline of the move """
+        self._moveStart = time.time()
+        available = self.remaining if self.moveLimit is None else min(self.remaining, self.moveLimit)
+        return Deadline(available, self)
+
+    def stopMove(self):
+        """ Stops the clock, returns time used by the move; flagged is set if the move overstepped the clock or moveLimit """
+        elapsed = time.time() - self._moveStart
+        self._moveStart = None
+        self.remaining -= elapsed
+        if self.remaining < 0 or (self.moveLimit is not None and elapsed > self.moveLimit):
+            self.flagged = True
+        self.remaining += self.increment
+        return elapsed
+
+
+def parseTimeControl(description):
+    """ Parses "total+increment" (seconds, e.g. "60+0.5") into a (total, increment) tuple """
+    total, _, increment = description.partition('+')
+    return float(total), float(increment or 0)
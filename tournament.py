@@ -0,0 +1,89 @@
+"""
+Parallel tournament engine: plays many games between two agent configurations over a process pool
+Every game has its own seed, colours are swapped every other game, results are streamed as JSON lines
+"""
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+from paratroopers import ParatroopersGame, GameSimulator
+
+
+class TournamentStats(object):
+    """ Online aggregation of game results, scores are from agent1's / agent2's point of view regardless of colours, a flag loses the game """
+
+    def __init__(self):
+        self.games = 0
+        self.wins = [0, 0]
+        self.draws = 0
+        self.totalScores = [0, 0]
+        self.flagged = 0
+
+    def add(self, result):
+        self.games += 1
+        self.totalScores[0] += result["agent1"]
+        self.totalScores[1] += result["agent2"]
+        if result.get("flagged"):
+            self.flagged += 1
+            self.wins[1 if result["flagged"] == "agent1" else 0] += 1
+        elif result["agent1"] > result["agent2"]:
+            self.wins[0] += 1
+        elif result["agent1"] < result["agent2"]:
+            self.wins[1] += 1
+        else:
+            self.draws += 1
+
+    def summary(self):
+        games = float(max(self.games, 1))
+        return {"games": self.games, "wonByAgent1": self.wins[0], "wonByAgent2": self.wins[1], "draws": self.draws, "flagged": self.flagged,
+                "totalScores": self.totalScores, "meanScores": [self.totalScores[0] / games, self.totalScores[1] / games],
+                "agent1WinRate": (self.wins[0] + 0.5 * self.draws) / games}
+
+
+def _initWorker():
+    """ The simulator reports e.g. agents running out of time on stdout, keep it out of the results stream """
+    sys.stdout = open(os.devnull, 'w')
+
+
+def _playGame(task):
+    """ Worker task: plays one game, returns its result record """
+    agentFactory, descriptions, K, board, timePerMove, timeControl, gameIndex, seed = task
+    random.seed(seed)
+    if "numpy" in sys.modules: sys.modules["numpy"].random.seed(seed)
+    swapped = gameIndex % 2 == 1  # agent2 moves first in odd games
+    agent1 = agentFactory(descriptions[0], ParatroopersGame.PLAYER2 if swapped else ParatroopersGame.PLAYER1, timePerMove)
+    agent2 = agentFactory(descriptions[1], ParatroopersGame.PLAYER1 if swapped else ParatroopersGame.PLAYER2, timePerMove)
+    game = ParatroopersGame(K, board)
+    gameSimulator = GameSimulator(game, (agent2, agent1) if swapped else (agent1, agent2), timeControl=timeControl)
+    gameSimulator.setSilent()
+    scores = gameSimulator.playGame()
+    result = {"game": gameIndex, "seed": seed, "swapped": swapped}
+    result["agent1"], result["agent2"] = (scores[1], scores[0]) if swapped else (scores[0], scores[1])
+    if gameSimulator.flagged is not None:  # index in the simulator's agent order
+        result["flagged"] = "agent2" if (gameSimulator.flagged == 0) == swapped else "agent1"
+    return result
+
+
+def runTournament(agentFactory, descriptions, K, board, games, workers=None, timePerMove=None, seed=None, output=sys.stdout, timeControl=None):
+    """
+        agentFactory: picklable (module level) function (description, player, timePerMove) -> agent
+        descriptions: pair of agent descriptions passed to agentFactory
+        K, board: the board all games are played on
+        workers: pool size (default - number of cores)
+        timeControl: (total, increment) clock of each agent, see GameSimulator
+        Writes one JSON line per finished game (in order of completion) and returns TournamentStats
+    """
+    rng = random.Random(seed)
+    tasks = [(agentFactory, descriptions, K, board, timePerMove, timeControl, gameIndex, rng.getrandbits(32)) for gameIndex in xrange(games)]
+    stats = TournamentStats()
+    pool = multiprocessing.Pool(workers, initializer=_initWorker)
+    try:
+        for result in pool.imap_unordered(_playGame, tasks):
+            stats.add(result)
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    finally:
+        pool.terminate()
+    return stats
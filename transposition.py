@@ -0,0 +1,85 @@
+"""
+Persistent transposition store for UCT statistics
+Fixed size table of (key, N, Q) entries kept in a memory-mapped file, so that later games on the same board
+and other worker processes can warm-start their searches
+"""
+import mmap
+import os
+import struct
+
+HEADER = struct.Struct('<4sQ')  # magic, number of entries
+ENTRY = struct.Struct('<Qdd')  # key (top bit marks a used slot), N, Q
+MAGIC = 'UCTT'
+USED = 1 << 63
+PLAYER_KEYS = [0, 0x2545f4914f6cdd1d, 0x1b873593cc9e2d51]  # mixed into the key, Q is stored from the searching player's perspective
+
+
+class TranspositionStore(object):
+    """
+        Table of size entries, an entry for a position lives in slot key % size
+        Replacement policy: a slot is overwritten by the same position or by a position with at least as many visits
+    """
+
+    def __init__(self, path, fingerprint, size=1 << 20, readOnly=False):
+        """
+            path: file backing the table, created (zero filled) if missing or of a different size
+            fingerprint: 63 bit fingerprint of the board (see ParatroopersGame.getFingerprint), mixed into every key
+            readOnly: open for lookups only, store() is then a no-op
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.size = size
+        self.readOnly = readOnly
+        if not readOnly and not self._isValidFile():
+            self._create()
+        self.file = open(path, 'rb' if readOnly else 'r+b')
+        self.table = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ if readOnly else mmap.ACCESS_WRITE)
+
+    def _isValidFile(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) != HEADER.size + self.size * ENTRY.size: return False
+        with open(self.path, 'rb') as f:
+            return HEADER.unpack(f.read(HEADER.size)) == (MAGIC, self.size)
+
+    def _create(self):
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, self.size))
+            f.truncate(HEADER.size + self.size * ENTRY.size)
+
+    def _entryKey(self, key, player):
+        return (key ^ self.fingerprint ^ PLAYER_KEYS[player]) | USED
+
+    def _offset(self, entryKey):
+        return HEADER.size + (entryKey % self.size) * ENTRY.size
+
+    def lookup(self, key, player):
+        """ Returns (N, Q) stored for position key searched by player, or None """
+        entryKey = self._entryKey(key, player)
+        storedKey, N, Q = ENTRY.unpack_from(self.table, self._offset(entryKey))
+        return (N, Q) if storedKey == entryKey else None
+
+    def store(self, key, player, N, Q):
+        """ Stores statistics of position key searched by player (subject to the replacement policy) """
+        if self.readOnly: return
+        entryKey = self._entryKey(key, player)
+        offset = self._offset(entryKey)
+        storedKey, storedN, _ = ENTRY.unpack_from(self.table, offset)
+        if storedKey == entryKey or storedN <= N:
+            ENTRY.pack_into(self.table, offset, entryKey, N, Q)
+
+    def asReadOnly(self):
+        """ Read-only store over the same file (e.g. for worker processes, which must not write) """
+        return self if self.readOnly else TranspositionStore(self.path, self.fingerprint, self.size, readOnly=True)
+
+    def flush(self):
+        if not self.readOnly: self.table.flush()
+
+    def close(self):
+        self.table.close()
+        self.file.close()
+
+    def __getstate__(self):
+        """ Pickling support: worker processes reopen the same file """
+        return (self.path, self.fingerprint, self.size, self.readOnly)
+
+    def __setstate__(self, pickled):
+        self.__init__(*pickled)